@@ -0,0 +1,74 @@
+"""
+Load time and peak memory of parsing a synthetic repo database
+
+Run with: python -m benchmarks.bench_database [packages]
+"""
+import multiprocessing
+import resource
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import make_repo_tar
+
+
+def load(path):
+    # Imported here so the child process only pays for what it measures
+    from fastpac.database import Database, Repo
+
+    start = time.perf_counter()
+    with tarfile.open(path) as tar:
+        repo = Repo(tar, Database(path=path))
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, peak_rss, len(repo.data)
+
+
+def retained(path, in_memory=False):
+    """
+    Memory still held by the parsed repo once loading is done. The database
+    is read again from path for other fields like with a cache_dir, or with
+    in_memory kept as its compressed bytes like without one
+    """
+    from fastpac.database import Database, Repo
+
+    with tarfile.open(path) as tar:
+        tracemalloc.start()
+        if in_memory:
+            with open(path, mode="rb") as f:
+                database = Database(data=f.read())
+        else:
+            database = Database(path=path)
+        repo = Repo(tar, database)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return size
+
+
+def main(packages=20000):
+    with tempfile.NamedTemporaryFile(suffix=".db.tar.gz") as db:
+        db.write(make_repo_tar(packages))
+        db.flush()
+
+        # A fresh interpreter for each so they only count the load itself
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(1) as pool:
+            elapsed, peak_rss, count = pool.apply(load, (db.name,))
+        with context.Pool(1) as pool:
+            retained_size = pool.apply(retained, (db.name,))
+        with context.Pool(1) as pool:
+            retained_in_memory = pool.apply(retained, (db.name, True))
+
+    print(f"packages:  {count}")
+    print(f"load time: {elapsed:.3f} s")
+    print(f"peak RSS:  {peak_rss / 1024:.1f} MiB")
+    print(f"retained:  {retained_size / 2**20:.1f} MiB")
+    print(f"retained without cache_dir: {retained_in_memory / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,67 @@
+"""
+Throughput and CPU cost of writing one big download to disk, with the old
+1 KiB iter_content loop compared to the reusable buffer of copy_response.
+The mirror runs in the same process so CPU time is only counted for the
+downloading thread
+
+Run with: python -m benchmarks.bench_download [size in MiB] [repeats]
+"""
+from hashlib import sha256 as new_sha256
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.common import FakeMirror
+import fastpac.download as download
+from fastpac import session
+
+
+def download_chunked(url, path, sha256="", timeout=None):
+    # How download_file_to_path wrote files before copy_response
+    digest = new_sha256()
+    request = session.get(url, stream=True, timeout=timeout)
+    request.raise_for_status()
+    with open(path, mode='wb') as f:
+        for part in request.iter_content(chunk_size=1024):
+            if part:
+                f.write(part)
+                digest.update(part)
+    if sha256 and digest.hexdigest() != sha256:
+        raise download.HashMismatchError(url)
+
+
+def measure(function, url, path, size, repeats, **kwargs):
+    best_wall = best_cpu = float("inf")
+    for _ in range(repeats):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        function(url, path, **kwargs)
+        best_wall = min(best_wall, time.perf_counter() - wall)
+        best_cpu = min(best_cpu, time.thread_time() - cpu)
+        path.unlink()
+    gb = size / 2**30
+    return size / 2**20 / best_wall, best_cpu / gb
+
+
+def main(size_mib=256, repeats=3):
+    size = size_mib * 2**20
+    body = bytes(range(256)) * (size // 256)
+    sha256 = new_sha256(body).hexdigest()
+
+    with FakeMirror({"/package.tar": body}) as mirror, tempfile.TemporaryDirectory() as dest:
+        url = mirror.url + "package.tar"
+        path = Path(dest) / "package.tar"
+        results = [
+            ("iter_content 1 KiB", measure(download_chunked, url, path, size, repeats, sha256=sha256)),
+            ("copy_response", measure(download.download_file_to_path, url, path, size, repeats, sha256=sha256)),
+            ("copy_response + fallocate", measure(download.download_file_to_path, url, path, size, repeats,
+                                                  sha256=sha256, preallocate=True)),
+        ]
+
+    print(f"file: {size_mib} MiB, best of {repeats}, sha256 checked")
+    for name, (throughput, cpu) in results:
+        print(f"{name:26} {throughput:8.0f} MB/s {cpu:6.2f} CPU s/GB")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
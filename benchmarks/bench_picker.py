@@ -0,0 +1,87 @@
+"""
+Offline simulation of a download run with every mirror picker. Mirrors have
+hidden bandwidths and latencies, their bandwidth is shared equally by the
+downloads running on them at any moment. Reports the makespan of each picker
+
+Run with: python -m benchmarks.bench_picker [packages] [workers] [seed]
+"""
+import random
+import sys
+
+import fastpac.picker as picker
+
+# (bytes per second, seconds of latency) of each simulated mirror
+MIRRORS = {
+    "https://fast/": (20 * 10**6, 0.02),
+    "https://good/": (10 * 10**6, 0.05),
+    "https://okay/": (5 * 10**6, 0.05),
+    "https://slow/": (1 * 10**6, 0.2),
+    "https://awful/": (0.2 * 10**6, 0.5),
+}
+
+
+def package_sizes(packages, rng):
+    # Most packages are small, a few are huge
+    return [int(rng.lognormvariate(13, 1.5)) for _ in range(packages)]
+
+
+def simulate(mirrorpicker, sizes, workers):
+    """
+    Returns the time the last download finishes
+    """
+    now = 0.0
+    pending = list(sizes)
+    # [mirror, size, bytes left, start time, latency left]
+    running = []
+
+    while pending or running:
+        while pending and len(running) < workers:
+            size = pending.pop(0)
+            mirror = mirrorpicker.next(size=size)
+            running.append([mirror, size, size, now, MIRRORS[mirror][1]])
+
+        # Downloads past their latency share their mirror's bandwidth equally
+        sharing = {}
+        for transfer in running:
+            if transfer[4] <= 0:
+                sharing[transfer[0]] = sharing.get(transfer[0], 0) + 1
+
+        def rate(transfer):
+            return MIRRORS[transfer[0]][0] / sharing[transfer[0]]
+
+        # Run until the next download finishes or gets past its latency
+        step = min(transfer[4] if transfer[4] > 0 else transfer[2] / rate(transfer) for transfer in running)
+        now += step
+        for transfer in running:
+            if transfer[4] > 0:
+                transfer[4] -= step
+            else:
+                transfer[2] -= rate(transfer) * step
+
+        for transfer in [t for t in running if t[4] <= 1e-9 and t[2] <= 1e-6]:
+            running.remove(transfer)
+            mirror, size, _, start, _ = transfer
+            if hasattr(mirrorpicker, "report"):
+                mirrorpicker.report(mirror, size, now - start, MIRRORS[mirror][1])
+        for transfer in running:
+            if 0 < transfer[4] <= 1e-9:
+                transfer[4] = 0
+    return now
+
+
+def main(packages=5000, workers=8, seed=0):
+    sizes = package_sizes(packages, random.Random(seed))
+    total = sum(sizes)
+    bandwidth = sum(bandwidth for bandwidth, _ in MIRRORS.values())
+
+    print(f"packages: {packages}, {total / 10**9:.2f} GB, {workers} workers")
+    print(f"ideal:            {total / bandwidth:8.1f} s")
+    for name in ["SinglePicker", "RandomPicker", "CounterPicker", "LeastUsedPicker", "ThroughputPicker"]:
+        # Same random choices for every run
+        random.seed(seed)
+        mirrorpicker = getattr(picker, name)(list(MIRRORS))
+        print(f"{name + ':':17} {simulate(mirrorpicker, sizes, workers):8.1f} s")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
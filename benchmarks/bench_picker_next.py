@@ -0,0 +1,65 @@
+"""
+Cost of a single pick for LeastUsedPicker and CapPicker with a large mirror
+list, against the linear scans they used to do
+
+Run with: python -m benchmarks.bench_picker_next [mirrors] [picks]
+"""
+import random
+import sys
+import time
+
+import fastpac.picker as picker
+
+
+class LinearLeastUsedPicker:
+    def __init__(self, mirrors, arg=None):
+        self._mirrors = [[mirror, 0] for mirror in mirrors]
+
+    def next(self, size=0):
+        smallest = 0
+        for num, (mirror, size_c) in enumerate(self._mirrors):
+            if size_c < self._mirrors[smallest][1]:
+                smallest = num
+        self._mirrors[smallest][1] += size
+        return self._mirrors[smallest][0]
+
+
+class LinearCapPicker:
+    def __init__(self, mirrors, arg=0):
+        self.cap = arg
+        self._mirrors = [[mirror, 0] for mirror in mirrors]
+
+    def next(self, size=0):
+        if size > self.cap:
+            return self._mirrors.pop(0)[0]
+        for num, (mirror, quota) in enumerate(self._mirrors):
+            if quota + size < self.cap:
+                self._mirrors[num][1] += size
+                return mirror
+
+
+def time_picks(mirrorpicker, sizes):
+    start = time.perf_counter()
+    for size in sizes:
+        mirrorpicker.next(size=size)
+    return (time.perf_counter() - start) / len(sizes)
+
+
+def main(mirrors=500, picks=50000):
+    names = [f"https://mirror{num}/" for num in range(mirrors)]
+    rng = random.Random(0)
+    sizes = [int(rng.lognormvariate(13, 1.5)) for _ in range(picks)]
+    # A cap that fills most mirrors by the end of the run
+    cap = sum(sizes) / mirrors * 1.2
+
+    print(f"{mirrors} mirrors, {picks} picks, time per pick")
+    for name, mirrorpicker in [
+            ("LeastUsedPicker (linear)", LinearLeastUsedPicker(names)),
+            ("LeastUsedPicker (heap)", picker.LeastUsedPicker(names)),
+            ("CapPicker (linear)", LinearCapPicker(names, cap)),
+            ("CapPicker (heap)", picker.CapPicker(names, cap))]:
+        print(f"{name + ':':26} {time_picks(mirrorpicker, sizes) * 10**6:8.2f} us")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,37 @@
+"""
+Time to build the package index and resolver and to take the dependency
+closure of every package in a synthetic repo
+
+Run with: python -m benchmarks.bench_resolve [packages]
+"""
+import io
+import sys
+import tarfile
+import time
+
+from benchmarks.common import make_repo_tar
+from fastpac.database import Repo
+from fastpac.resolve import Resolver
+from fastpac.search import PackageIndex, RepoMeta
+
+
+def main(packages=20000):
+    with tarfile.open(fileobj=io.BytesIO(make_repo_tar(packages))) as tar:
+        repos = [RepoMeta(name="core", mirror="https://a", db=Repo(tar))]
+
+    start = time.perf_counter()
+    index = PackageIndex(repos)
+    indexed = time.perf_counter()
+    resolver = Resolver(index)
+    built = time.perf_counter()
+    found, missing = resolver.closure(name for name, _ in index.items())
+    closed = time.perf_counter()
+
+    print(f"packages:       {len(index)} ({len(found)} resolved, {len(missing)} missing)")
+    print(f"index build:    {indexed - start:.3f} s")
+    print(f"resolver build: {built - indexed:.3f} s")
+    print(f"full closure:   {closed - built:.3f} s")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,49 @@
+"""
+Many small package downloads from a local mirror with a new connection per
+request compared to the shared keep-alive session
+
+Run with: python -m benchmarks.bench_session [packages] [workers]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from benchmarks.common import FakeMirror
+import fastpac.download as download
+from fastpac import session
+
+
+def run(mirror, packages, workers, dest):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(download.download_file_to_path, f"{mirror.url}package{num}", dest / f"package{num}")
+                   for num in range(packages)]
+        for future in futures:
+            future.result()
+    return time.perf_counter() - start
+
+
+def main(packages=2000, workers=4):
+    files = {f"/package{num}": b"x" * 4096 for num in range(packages)}
+    with FakeMirror(files) as mirror, tempfile.TemporaryDirectory() as dest:
+        dest = Path(dest)
+
+        # A fresh connection for every package
+        download.get_url = requests.get
+        fresh = run(mirror, packages, workers, dest)
+
+        download.get_url = session.get
+        session.configure(pool_size=workers)
+        pooled = run(mirror, packages, workers, dest)
+
+    print(f"packages:       {packages} with {workers} workers")
+    print(f"new connection: {fresh:.3f} s ({packages / fresh:.0f} packages/s)")
+    print(f"shared session: {pooled:.3f} s ({packages / pooled:.0f} packages/s)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,208 @@
+"""
+The whole pipeline against a local farm of mirrors with different bandwidths,
+latencies and failure rates: fetching the repos, looking packages up, a
+download with every picker and a full run of main. Results are written as
+JSON with the git revision so runs on different commits can be compared
+
+Run with: python -m benchmarks.bench_suite [--packages N] [--output FILE] [--compare FILE]
+"""
+import argparse
+import json
+import logging
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.farm import DEFAULT_MIRRORS, MirrorFarm, make_packages, mirror_files
+import fastpac.__main__ as fastpac_main
+from fastpac.health import HealthyPicker, MirrorHealth
+import fastpac.picker as picker
+from fastpac.search import PackageIndex, download_repos, find_package
+from fastpac import session
+
+PICKERS = ["SinglePicker", "RandomPicker", "CounterPicker", "LeastUsedPicker", "CapPicker", "ThroughputPicker"]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def peak_rss():
+    # ru_maxrss is in KiB on Linux, it only ever goes up
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_download_repos(farm, repos):
+    start = time.perf_counter()
+    databases = download_repos(repos, farm.urls, workers=len(repos))
+    elapsed = time.perf_counter() - start
+    assert all(databases), "a repo could not be fetched"
+    return databases, {"fetch_seconds": elapsed, "peak_rss_kib": peak_rss()}
+
+
+def bench_lookup(databases, names):
+    start = time.perf_counter()
+    for name in names:
+        find_package(name, databases)
+    linear = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = PackageIndex(databases)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.find_all(names)
+    lookup = time.perf_counter() - start
+    return index, {
+        "find_package_seconds": linear,
+        "index_build_seconds": build,
+        "index_lookup_seconds": lookup,
+        "lookups": len(names),
+    }
+
+
+def picker_args(name, package_infos, mirrors):
+    if name == "CapPicker":
+        # Twice an even share of the run per mirror. Failed downloads are never
+        # given back to the cap, so the flaky mirrors need the headroom
+        total = sum(info.size for info in package_infos)
+        return (max(2 * total // len(mirrors), 2 * max(info.size for info in package_infos)),)
+    return ()
+
+
+def bench_picker(name, farm, package_infos, workers):
+    config = {"workers": workers, "retries": 5, "backoff": 0, "timeout": 10}
+    mirrorpicker = HealthyPicker(getattr(picker, name)(farm.urls, *picker_args(name, package_infos, farm.urls)),
+                                 MirrorHealth())
+    with tempfile.TemporaryDirectory() as dest:
+        start = time.perf_counter()
+        results = fastpac_main.download_threaded(package_infos, Path(dest), config, mirrorpicker)
+        elapsed = time.perf_counter() - start
+    total = sum(info.size for info in package_infos)
+    return {
+        "makespan_seconds": elapsed,
+        "throughput_mb_s": total / 2**20 / elapsed,
+        "downloaded": len(results),
+        "packages": len(package_infos),
+    }
+
+
+def bench_main(farm, repos, names, workers):
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        (root / "lists").mkdir()
+        (root / "pkg").mkdir()
+        (root / "lists" / "host").write_text("".join(f"{name} 1.0-1\n" for name in names))
+        (root / "config.py").write_text(
+            f"mirrorlist = {farm.urls!r}\n"
+            f"databases = download_repos({list(repos)!r}, mirrorlist)\n"
+            f"mirrorpicker = ThroughputPicker(mirrorlist)\n"
+            f"package_list_dir = {str(root / 'lists')!r}\n"
+            f"download_dir = {str(root / 'pkg')!r}\n"
+            f"workers = {workers}\n"
+            f"backoff = 0\n"
+        )
+        args = argparse.Namespace(config_file=root / "config.py", log_level=None, changed_only=False, daemon=False)
+
+        start = time.perf_counter()
+        fastpac_main.main(args)
+        elapsed = time.perf_counter() - start
+        downloaded = sum(1 for path in (root / "pkg").iterdir() if not path.name.endswith(".part"))
+        size = sum(path.stat().st_size for path in (root / "pkg").iterdir())
+    return {
+        "makespan_seconds": elapsed,
+        "throughput_mb_s": size / 2**20 / elapsed,
+        "downloaded": downloaded,
+        "peak_rss_kib": peak_rss(),
+    }
+
+
+def run(packages, workers, seed):
+    repos = ("core", "extra")
+    synthetic = make_packages(packages, repos=repos, seed=seed)
+    names = [package.name for package in synthetic]
+    results = {}
+
+    with MirrorFarm(mirror_files(synthetic), seed=seed) as farm:
+        session.configure(pool_size=workers)
+
+        databases, results["download_repos"] = bench_download_repos(farm, repos)
+        index, results["lookup"] = bench_lookup(databases, names)
+
+        package_infos = sorted(index.find_all(names).values(), key=lambda info: info.name)
+        for name in PICKERS:
+            results[name] = bench_picker(name, farm, package_infos, workers)
+
+        results["main"] = bench_main(farm, repos, names, workers)
+        results["mirrors"] = farm.stats()
+
+    return {
+        "git_revision": git_revision(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "parameters": {"packages": packages, "workers": workers, "seed": seed, "mirrors": DEFAULT_MIRRORS},
+        "results": results,
+    }
+
+
+def compare(old, new, threshold):
+    """
+    Print every timing of new next to the one in old. Returns the timings that
+    got worse by more than threshold, ignoring differences of under 10ms that
+    are only noise
+    """
+    print(f"{'':40} {old['git_revision'][:10]:>12} {new['git_revision'][:10]:>12}")
+    regressions = []
+    for stage, values in new["results"].items():
+        for key, value in values.items():
+            before = old["results"].get(stage, {}).get(key)
+            if not key.endswith("_seconds") or not isinstance(before, (int, float)):
+                continue
+            change = (value - before) / before if before else 0.0
+            flag = " worse" if change > threshold and value - before > 0.01 else ""
+            print(f"{stage + ' ' + key:40} {before:12.3f} {value:12.3f} {change:+7.1%}{flag}")
+            if flag:
+                regressions.append(f"{stage} {key}")
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    p.add_argument("--packages", type=int, default=400)
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--output", type=Path, help="Write the results here as JSON")
+    p.add_argument("--compare", type=Path, help="Results of an earlier run to compare with")
+    p.add_argument("--threshold", type=float, default=0.2,
+                   help="With --compare, exit with 1 if a timing is this much worse (default 0.2)")
+    args = p.parse_args()
+
+    # Failed downloads from the flaky mirrors are expected
+    logging.getLogger("fastpac").setLevel(logging.ERROR)
+
+    report = run(args.packages, args.workers, args.seed)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    for stage, values in report["results"].items():
+        if stage != "mirrors":
+            print(stage, " ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                                  for key, value in values.items()))
+
+    if args.compare:
+        regressions = compare(json.loads(args.compare.read_text()), report, args.threshold)
+        if regressions:
+            print("Worse than", args.compare, ":", ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Helpers shared by the benchmarks
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import tarfile
+import threading
+
+
+def make_desc(num):
+    """
+    Create the desc file of a synthetic package that looks like one from a real repo
+    """
+    name = f"package{num}"
+    return (
+        f"%FILENAME%\n{name}-1.0.{num}-1-x86_64.pkg.tar.zst\n\n"
+        f"%NAME%\n{name}\n\n"
+        f"%BASE%\n{name}\n\n"
+        f"%VERSION%\n1.0.{num}-1\n\n"
+        f"%DESC%\nSynthetic package number {num} used for benchmarking fastpac\n\n"
+        f"%CSIZE%\n{1000 + num * 37}\n\n"
+        f"%ISIZE%\n{4000 + num * 91}\n\n"
+        f"%MD5SUM%\n{num:032x}\n\n"
+        f"%SHA256SUM%\n{num:064x}\n\n"
+        f"%URL%\nhttps://example.com/{name}\n\n"
+        f"%LICENSE%\nGPL3\n\n"
+        f"%ARCH%\nx86_64\n\n"
+        f"%BUILDDATE%\n1600000000\n\n"
+        f"%PACKAGER%\nBenchmark <bench@example.com>\n\n"
+        f"%DEPENDS%\nglibc\npackage{num // 2}>=1.0\n\n"
+        f"%PROVIDES%\nlib{name}.so=1-64\n\n"
+    ).encode()
+
+
+def make_repo_tar(packages, compression="gz"):
+    """
+    Create a repo database with a number of synthetic packages in the same layout pacman uses
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=f"w:{compression}") as tar:
+        for num in range(packages):
+            directory = tarfile.TarInfo(name=f"package{num}-1.0.{num}-1")
+            directory.type = tarfile.DIRTYPE
+            tar.addfile(directory)
+
+            desc = make_desc(num)
+            desc_info = tarfile.TarInfo(name=f"package{num}-1.0.{num}-1/desc")
+            desc_info.size = len(desc)
+            tar.addfile(desc_info, fileobj=io.BytesIO(desc))
+    return buffer.getvalue()
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    # Clients hanging up early is expected, don't print tracebacks for it
+    def handle_error(self, request, client_address):
+        pass
+
+
+class FakeMirror:
+    """
+    A local HTTP/1.1 server with keep-alive serving the bytes in `files`
+    """
+    def __init__(self, files=None):
+        self.files = files if files is not None else {}
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = mirror.files.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = QuietHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,182 @@
+"""
+A farm of local mirrors with their own bandwidth, latency and failure rate,
+serving synthetic repo databases and packages in the layout of a real mirror
+"""
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler
+import io
+import random
+import tarfile
+import threading
+import time
+from typing import NamedTuple
+
+from benchmarks.common import QuietHTTPServer
+from fastpac.ratelimit import TokenBucket
+
+# (bytes per second, seconds before each response, share of requests answered with a 503)
+DEFAULT_MIRRORS = [
+    (40 * 2**20, 0.002, 0.0),
+    (20 * 2**20, 0.005, 0.0),
+    (10 * 2**20, 0.01, 0.02),
+    (4 * 2**20, 0.02, 0.05),
+    (1 * 2**20, 0.05, 0.1),
+]
+
+
+class SyntheticPackage(NamedTuple):
+    repo: str
+    name: str
+    filename: str
+    body: memoryview
+
+
+def make_packages(count, repos=("core", "extra"), seed=0, median_size=64 * 2**10, max_size=8 * 2**20):
+    """
+    count packages spread over repos. Most are small and a few are big like in a
+    real repo, every package depends on one before it so resolving has work to do
+    """
+    rng = random.Random(seed)
+    # Bodies are slices of one block so the farm does not hold a copy per package
+    block = memoryview(rng.randbytes(max_size + 251))
+    packages = []
+    for num in range(count):
+        size = min(max_size, max(1, int(rng.lognormvariate(0, 1.2) * median_size)))
+        name = f"package{num}"
+        packages.append(SyntheticPackage(
+            repo=repos[num % len(repos)],
+            name=name,
+            filename=f"{name}-1.0-1-x86_64.pkg.tar.zst",
+            body=block[num % 251:num % 251 + size],
+        ))
+    return packages
+
+
+def make_repo_db(packages):
+    """
+    A repo database of packages with their real sizes and hashes
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for num, package in enumerate(packages):
+            depends = f"%DEPENDS%\n{packages[num // 2].name}\n\n" if num else ""
+            desc = (
+                f"%FILENAME%\n{package.filename}\n\n"
+                f"%NAME%\n{package.name}\n\n"
+                f"%VERSION%\n1.0-1\n\n"
+                f"%CSIZE%\n{len(package.body)}\n\n"
+                f"%SHA256SUM%\n{sha256(package.body).hexdigest()}\n\n"
+                f"{depends}"
+            ).encode()
+            info = tarfile.TarInfo(name=f"{package.name}-1.0-1/desc")
+            info.size = len(desc)
+            tar.addfile(info, fileobj=io.BytesIO(desc))
+    return buffer.getvalue()
+
+
+def mirror_files(packages, arch="x86_64"):
+    """
+    Every path a mirror serves for packages, databases included
+    """
+    files = {}
+    repos = {}
+    for package in packages:
+        files[f"/{package.repo}/os/{arch}/{package.filename}"] = package.body
+        repos.setdefault(package.repo, []).append(package)
+    for repo, repo_packages in repos.items():
+        # Real mirrors have both, .db links to .db.tar.gz
+        files[f"/{repo}/os/{arch}/{repo}.db"] = make_repo_db(repo_packages)
+        files[f"/{repo}/os/{arch}/{repo}.db.tar.gz"] = files[f"/{repo}/os/{arch}/{repo}.db"]
+    return files
+
+
+class FarmMirror:
+    """
+    A local HTTP/1.1 mirror whose bandwidth is shared by all its connections
+    """
+    def __init__(self, files, bandwidth=None, latency=0.0, failure_rate=0.0, seed=0):
+        self.files = files
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.bucket = TokenBucket(bandwidth, burst=2**16)
+        self.requests = 0
+        self.failures = 0
+        rng = random.Random(seed)
+        rng_lock = threading.Lock()
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(mirror.latency)
+                with rng_lock:
+                    mirror.requests += 1
+                    failed = rng.random() < mirror.failure_rate
+                    mirror.failures += failed
+
+                body = mirror.files.get(self.path)
+                if failed or body is None:
+                    self.send_response(503 if failed else 404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                start, end = 0, len(body) - 1
+                ranged = self.headers.get("Range", "").startswith("bytes=")
+                if ranged:
+                    first, _, last = self.headers["Range"][6:].partition("-")
+                    start = int(first)
+                    end = min(int(last), end) if last else end
+                    if start > end:
+                        self.send_response(416)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+
+                self.send_response(206 if ranged else 200)
+                if ranged:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+                self.send_header("Content-Length", str(end + 1 - start))
+                self.end_headers()
+
+                view = memoryview(body)[start:end + 1]
+                for offset in range(0, len(view), 2**16):
+                    chunk = view[offset:offset + 2**16]
+                    mirror.bucket.consume(len(chunk))
+                    self.wfile.write(chunk)
+
+        self.httpd = QuietHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MirrorFarm:
+    """
+    One FarmMirror per (bandwidth, latency, failure_rate) in specs, all serving the same files
+    """
+    def __init__(self, files, specs=DEFAULT_MIRRORS, seed=0):
+        self.mirrors = [FarmMirror(files, *spec, seed=seed + num) for num, spec in enumerate(specs)]
+        self.urls = [mirror.url for mirror in self.mirrors]
+
+    def stats(self):
+        return {mirror.url: {"requests": mirror.requests, "failures": mirror.failures} for mirror in self.mirrors}
+
+    def close(self):
+        for mirror in self.mirrors:
+            mirror.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
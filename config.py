@@ -2,23 +2,104 @@
 #mirrorlist = get_mirrorlist_online("https://www.archlinux.org/mirrors/status/json/")
 # Default location looks at mirrors in /etc/pacman.d/mirrorlist
 mirrorlist = get_mirrorlist_offline()
+# Optional: time a request to every mirror and keep the fastest that are up to date. The ranking
+# is remembered for `ttl` seconds
+#mirrorlist = probe_mirrors(mirrorlist, top=10, cache_file='/var/cache/fastpac/mirrors.json', ttl=3600)
 
-# This contains repos and their package databases.
-databases = download_repos(["core", "extra", "community", "multilib"], mirrorlist)
+# Parsed package databases are kept here between runs. A database is only downloaded again
+# when the mirror says it changed.
+cache_dir = '/var/cache/fastpac/db'
+
+# This contains repos and their package databases. Repos are downloaded at the same time, pass
+# race=N to download each one from the first N mirrors at once and keep the fastest.
+databases = download_repos(["core", "extra", "community", "multilib"], mirrorlist, cache_dir=cache_dir)
 
 # What mirror should the package be downloaded from? There are a variety of preimplement ways in
 # fastpac.mirrorlist. Some implementations will run out of mirrorrs to select from if not enough
 # are present. This one will chose the mirror that has been used the least, taking into account
-# package size. CapPicker will assign a virtual cap to each mirror.
+# package size. CapPicker will assign a virtual cap to each mirror. ThroughputPicker measures
+# every mirror and sends each package to the one expected to finish it first.
 mirrorpicker = LeastUsedPicker(mirrorlist)
 
 # Directory which the agents on remote systems put their package lists in
 package_list_dir = '/var/cache/fastpac/packagelists'
 
+# Optional: number of package lists read at the same time (default 8)
+# list_workers = 8
+
+# Optional: with --daemon fastpac keeps running. New package lists are downloaded as soon as
+# they are written (instantly with inotify_simple installed, otherwise package_list_dir is
+# checked every poll_interval seconds) and the databases are reloaded every refresh_interval seconds
+# refresh_interval = 3600
+# poll_interval = 5
+
 # Destination of downloads
 download_dir = '/var/cache/fastpac/pkg'
 
+# Optional: also download the dependencies of every listed package (default True)
+# resolve_depends = True
+
 # Optional: operating system architecture
 # architecture = 'x86_64'
 
 workers = 4
+
+# Optional: bandwidth limits in bytes per second, for all downloads together and for the
+# downloads from any one mirror (default no limit). With --daemon they are read again every
+# refresh_interval so they can be changed without restarting
+# rate_limit = 50 * 2**20
+# mirror_rate_limit = 10 * 2**20
+
+# Optional: allocate each package's full size on disk before downloading it so it is not
+# fragmented (default False)
+# preallocate = False
+
+# Optional: counters and timings of the run (repo fetch and parse, lookups, lock waits, hashing,
+# bytes, retries and failures per mirror) written after every run as a Prometheus text file, for
+# node_exporter's textfile collector, and as JSON
+# metrics_file = '/var/lib/node_exporter/textfile_collector/fastpac.prom'
+# metrics_json = '/var/cache/fastpac/metrics.json'
+
+# Optional: order of the download queue. 'longest' (default) starts the biggest packages first so
+# the run does not end waiting on one of them, 'name' is alphabetical
+# schedule = 'longest'
+
+# Optional: how often a failed download is tried again on another mirror (default 3), waiting
+# `backoff` seconds before the first retry and twice as long before each one after (default 1)
+# retries = 3
+# backoff = 1
+# Optional: seconds a mirror can go quiet before the download is abandoned (default 30)
+# timeout = 30
+# Optional: a mirror that fails this many downloads in a row is left out for `mirror_cooldown`
+# seconds, twice as long each time it fails again right after coming back (defaults 3 and 60)
+# mirror_failure_threshold = 3
+# mirror_cooldown = 60
+
+# Optional: packages at least this many bytes are split into `segments` byte ranges downloaded
+# from different mirrors at the same time (thread engine only)
+segment_threshold = 100 * 2**20
+# segments = 4
+
+# Optional: 'threads' (default) downloads with `workers` threads. 'async' runs every download on
+# one thread with asyncio and needs aiohttp (pip install fastpac[async])
+# engine = 'async'
+# Optional: with the async engine, downloads in flight at once and to a single mirror
+# async_concurrency = 100
+# mirror_concurrency = 8
+
+# Optional: remember which downloaded packages were verified so unchanged files are not hashed
+# again every run
+ledger_file = '/var/cache/fastpac/ledger.json'
+
+# Optional: every package is also kept here under its sha256. A package already in the store,
+# from another download_dir or architecture, is hardlinked (or reflinked, or copied when on
+# another filesystem) into place instead of downloaded
+# store_dir = '/var/cache/fastpac/store'
+
+# Optional: every repo's package versions are saved here after each run. With
+# --changed-only only packages that are new or changed since then are downloaded.
+# Run without it now and then to catch files removed from download_dir
+snapshot_file = '/var/cache/fastpac/snapshot.json'
+
+# Optional: number of threads hashing packages that are already downloaded (default 2)
+# hash_workers = 2
@@ -1,83 +1,152 @@
 import argparse
+from contextlib import contextmanager
 import logging
 from threading import Lock
-from typing import Any, Dict, List, Set
+from time import monotonic, perf_counter, sleep
+from typing import Any, Dict, List
 from pathlib import Path
 import runpy
-from hashlib import sha256
-from os import remove as remove_file
 
-from fastpac.mirror import get_mirrorlist_online, get_mirrorlist_offline
-from fastpac.search import find_package, download_repos
+from fastpac.aio import AsyncDownloader
+from fastpac.packagelist import PackageLists
+from fastpac.mirror import get_mirrorlist_online, get_mirrorlist_offline, probe_mirrors
+from fastpac.resolve import Resolver
+from fastpac.schedule import order_packages, report_makespan
+from fastpac.search import PackageIndex, download_repos
+from fastpac.ratelimit import RateLimiter
+from fastpac.snapshot import RepoSnapshot
+from fastpac.store import ContentStore
+from fastpac.watch import ListWatcher
+from fastpac import metrics, session
 from fastpac.util import HybridGenerator, ThreadPoolExecutorStackTraced
-from fastpac.download import assemble_package_url, download_file_to_path
+from fastpac.ledger import VerificationLedger
+from fastpac.download import (assemble_package_url, download_file_segmented, download_file_to_path, download_retries,
+                               record_failure, record_transfer, verify_package)
+from fastpac.health import HealthyPicker, MirrorHealth
 from fastpac.picker import *
 
 
 log = logging.getLogger('fastpac.__main__')
 
+lock_wait_seconds = metrics.histogram('fastpac_lock_wait_seconds', 'Time waiting for a lock', ('lock',))
 
-def download_package(name, dest, databases, databases_lock, mirrorpicker, mirrorpicker_lock, arch):
-    # find_package returns the filename for the current version and
-    # its repo of residence. Both are needed to make the download url
-    with databases_lock:
-        package_info = find_package(name, databases)
-
-    # find_package will return None if no package is in the database
-    if not package_info:
-        log.warning('%r could not be found', name)
-        return
-
-    filename = package_info.filename
-    # If it is already present we skip this package
-    file_path = dest / filename
-    if file_path.is_file():
-        log.info('%r already exists', filename)
-        log.debug("file_path %r", file_path)
-
-        # Calculate current file's hash
 
-        # If the sha256 hash is not provided skip
-        if not package_info.sha256:
-            return
+@contextmanager
+def timed_lock(lock, name):
+    """
+    Hold lock, counting how long it took to get it
+    """
+    start = perf_counter()
+    with lock:
+        lock_wait_seconds.observe(perf_counter() - start, lock=name)
+        yield
 
-        # Hash from repo
-        remote_hash = package_info.sha256
 
-        with open(file_path, mode='rb') as package_file:
-            current_hash = sha256(package_file.read()).hexdigest()
+def download_package(package_info, dest, mirrorpicker, mirrorpicker_lock, arch, ledger=None, attempts=3,
+                     segment_threshold=None, segments=4, health=None, backoff=1, max_backoff=60,
+                     timeout=None, store=None, preallocate=False, limiter=None):
+    """
+    Download a package, trying other mirrors if it fails. Returns the
+    Transfers it took or None if every attempt failed
+    """
+    # package_info has the filename for the current version and
+    # its repo of residence. Both are needed to make the download url
+    filename = package_info.filename
+    size = int(package_info.size)
 
-        # Hashs match skip package
-        log.debug("Remote hash %r", remote_hash)
-        log.debug("Local hash  %r", current_hash)
-        if remote_hash == current_hash:
-            log.info("%r has matching hashs", name)
-            return
+    # Downloaded before for another download_dir or architecture. It is left
+    # out of the ledger so the next run hashes it once
+    if store and package_info.sha256 and store.fetch(package_info.sha256, dest / filename):
+        return None
 
-        log.warning("Local package file %r does not have matching hashs", name)
-        remove_file(file_path)
-        log.info("Removed local copy of package %r", file_path)
+    # Big packages are split into ranges downloaded from several mirrors at once
+    segmented = bool(segment_threshold) and size >= segment_threshold and segments > 1
 
     # Try downloading a package from a mirror until one works
-    while True:
-        # Picking a mirror to use
-        with mirrorpicker_lock:
-            mirror = mirrorpicker.next(size=int(package_info.size))
+    for attempt in range(attempts):
+        if attempt:
+            download_retries.inc()
+            sleep(min(backoff * 2 ** (attempt - 1), max_backoff))
 
-        # Combine the mirror url with info from databases to make a download url
-        package_mirror = assemble_package_url(package_info, mirror, arch=arch)
+        booked = size // segments if segmented else size
+        mirrors = []
+        try:
+            # Picking a mirror to use
+            with timed_lock(mirrorpicker_lock, 'mirrorpicker'):
+                for _ in range(segments if segmented else 1):
+                    mirrors.append(mirrorpicker.next(size=booked))
+
+            # Combine the mirror url with info from databases to make a download url.
+            # A picker out of mirrors gives None or raises, that is a failed attempt too
+            package_mirrors = [assemble_package_url(package_info, mirror, arch=arch) for mirror in mirrors]
+        except Exception as e:
+            log.warning('No mirror to download %r from: %r', filename, e)
+            # The mirrors that were picked did not fail, they only get their booking back
+            if hasattr(mirrorpicker, 'report_failure'):
+                with timed_lock(mirrorpicker_lock, 'mirrorpicker'):
+                    for mirror in mirrors:
+                        if mirror is not None:
+                            mirrorpicker.report_failure(mirror, booked)
+            continue
+
+        package_mirror = ", ".join(package_mirrors)
+        throttles = [limiter.throttle(mirror) for mirror in mirrors] if limiter else [None] * len(mirrors)
 
         # Download
         log.info('Downloading %r from %s', filename, package_mirror)
         try:
-            download_file_to_path(package_mirror, dest / filename)
+            if segmented:
+                transfers = download_file_segmented(package_mirrors, dest / filename, size,
+                                                    sha256=package_info.sha256, timeout=timeout,
+                                                    preallocate=preallocate, throttles=throttles)
+            else:
+                transfers = [download_file_to_path(package_mirrors[0], dest / filename,
+                                                   sha256=package_info.sha256, timeout=timeout,
+                                                   preallocate=preallocate, throttle=throttles[0])]
         except Exception as e:
-            log.exception(e)
+            log.warning('Downloading %r from %s failed: %r', filename, package_mirror, e)
+            for mirror in mirrors:
+                record_failure(mirror)
+            if health:
+                for mirror in mirrors:
+                    health.failure(mirror)
+            if hasattr(mirrorpicker, 'report_failure'):
+                with timed_lock(mirrorpicker_lock, 'mirrorpicker'):
+                    for mirror in mirrors:
+                        mirrorpicker.report_failure(mirror, booked)
             # Go to next mirror
+            continue
+
+        if health:
+            for mirror in mirrors:
+                health.success(mirror)
+
+        # A range that failed on its own mirror came from another one
+        url_mirrors = dict(zip(package_mirrors, mirrors))
+        for transfer in transfers:
+            record_transfer(url_mirrors[transfer.url], transfer)
+
+        # Pickers that learn from finished downloads
+        if hasattr(mirrorpicker, 'report'):
+            with timed_lock(mirrorpicker_lock, 'mirrorpicker'):
+                for mirror, url, transfer in zip(mirrors, package_mirrors, transfers):
+                    if transfer.url == url:
+                        mirrorpicker.report(mirror, booked, transfer.seconds, transfer.latency, transfer.size)
+                    else:
+                        # This range came from another mirror
+                        mirrorpicker.report_failure(mirror, booked)
+
+        # Hashed while downloading, no need to read it again next run
+        if ledger and package_info.sha256:
+            ledger.record(dest / filename, package_info.sha256)
+        if store and package_info.sha256:
+            store.add(package_info.sha256, dest / filename)
 
         log.info('Finished downloading %s', package_mirror)
-        # Next package
-        break
+        return transfers
+
+    log.error('Giving up on %r after %d attempts', filename, attempts)
+    return None
 
 
 def load_config(path: Path) -> Dict[str, Any]:
@@ -90,25 +159,11 @@ def load_config(path: Path) -> Dict[str, Any]:
     init_globals = {k: v for (k, v) in globals().items()
                     if k.endswith('Picker') or k.endswith('Generator')
                     or k.startswith('get_mirrorlist')
+                    or k == "probe_mirrors"
                     or k == "download_repos"}
     return runpy.run_path(path, init_globals=init_globals)
 
 
-def make_package_list(path: Path) -> Set[str]:
-    """
-    Makes the package list from a directory with newline delimited
-    files.
-
-    Parameters:
-    path -- Path object to directory with package list files
-    """
-    packages = set()
-    for child in path.iterdir():
-        with child.open('r') as h:
-            packages.update(s.partition(' ')[0] for s in h.readlines())
-    return packages
-
-
 class PathFileType:
     def __init__(self):
         pass
@@ -125,40 +180,272 @@ def parse_args() -> argparse.Namespace:
     p.add_argument('--config-file', type=PathFileType(),
                    default='/etc/fastpac.conf.py', help='Path to config file')
     p.add_argument('--log-level', default=None, help='Log level')
+    p.add_argument('--changed-only', action='store_true',
+                   help='Only download packages that changed since the last run (needs snapshot_file)')
+    p.add_argument('--daemon', action='store_true',
+                   help='Keep running, download new packages as soon as they are listed')
     return p.parse_args()
 
 
+def check_package(package_info, file_path, ledger=None, store=None):
+    """
+    verify_package, adding good packages to the store
+    """
+    if not verify_package(package_info, file_path, ledger):
+        # It may have been a hardlink of the store entry
+        if store and package_info.sha256:
+            store.evict(package_info.sha256)
+        return False
+    if store and package_info.sha256:
+        store.add(package_info.sha256, file_path)
+    return True
+
+
+def download_threaded(package_infos, dest, config, mirrorpicker, ledger=None, health=None, store=None,
+                      limiter=None):
+    """
+    Download packages with a pool of `workers` threads, in the order given.
+    Returns the Transfers of each package that was downloaded
+    """
+    mirrorpicker_lock = Lock()
+
+    # Packages that are already present are hashed in their own pool so
+    # download workers are never stuck reading files
+    with ThreadPoolExecutorStackTraced(max_workers=config['workers']) as pool, \
+            ThreadPoolExecutorStackTraced(max_workers=config.get('hash_workers', 2)) as hash_pool:
+        def submit_download(package_info):
+            return pool.submit(
+                download_package,
+                package_info,
+                dest,
+                mirrorpicker,
+                mirrorpicker_lock,
+                config.get('architecture', 'x86_64'),
+                ledger,
+                attempts=config.get('retries', 3) + 1,
+                segment_threshold=config.get('segment_threshold'),
+                segments=config.get('segments', 4),
+                health=health,
+                backoff=config.get('backoff', 1),
+                timeout=config.get('timeout', 30),
+                store=store,
+                preallocate=config.get('preallocate', False),
+                limiter=limiter
+                )
+
+        futures = []
+        checks = []
+        for package_info in package_infos:
+            file_path = dest / package_info.filename
+            if ledger and ledger.is_verified(file_path, package_info.sha256):
+                log.debug('%r already verified', package_info.filename)
+            elif file_path.is_file():
+                checks.append((package_info, hash_pool.submit(check_package, package_info, file_path, ledger, store)))
+            else:
+                futures.append(submit_download(package_info))
+
+        # Packages whose local copy was bad are downloaded again
+        for package_info, check in checks:
+            if not check.result():
+                futures.append(submit_download(package_info))
+
+        results = [future.result() for future in futures]
+        return [result for result in results if result]
+
+
+def wanted_packages(config, index, package_lists):
+    """
+    Every package in the package lists plus what they depend on, sorted
+    """
+    # Follow renames and provides, and fetch new dependencies before clients ask for them.
+    # Names are resolved while the lists are still being read
+    package_names, missing = Resolver(index).closure(
+        package_lists.iter_names(), depends=config.get('resolve_depends', True))
+    for package_name in sorted(missing):
+        log.warning('%r could not be found', package_name)
+    return sorted(package_names)
+
+
+def sync(config, index, package_names, dest, mirrorpicker, ledger=None, health=None, store=None,
+         limiter=None):
+    """
+    Download package_names. Returns their PackageInfos
+    """
+    # Biggest packages first by default so none of them is left for the end
+    package_infos = order_packages(index.find_all(package_names).values(), config.get('schedule', 'longest'))
+    start = perf_counter()
+    try:
+        if config.get('engine', 'threads') == 'async':
+            workers = config.get('async_concurrency', 100)
+            results = AsyncDownloader(
+                dest,
+                mirrorpicker,
+                arch=config.get('architecture', 'x86_64'),
+                ledger=ledger,
+                concurrency=config.get('async_concurrency', 100),
+                mirror_concurrency=config.get('mirror_concurrency', 8),
+                hash_workers=config.get('hash_workers', 2),
+                attempts=config.get('retries', 3) + 1,
+                health=health,
+                backoff=config.get('backoff', 1),
+                timeout=config.get('timeout', 30),
+                store=store,
+                limiter=limiter
+                ).run(package_infos)
+        else:
+            workers = config['workers']
+            results = download_threaded(package_infos, dest, config, mirrorpicker, ledger, health, store, limiter)
+        report_makespan(results, workers, perf_counter() - start)
+        if store:
+            hits, saved_bytes = store.take_stats()
+            log.info('Took %d packages (%.1f MB) from the store instead of downloading them',
+                     hits, saved_bytes / 2**20)
+    finally:
+        if ledger:
+            ledger.save()
+        # Totals since fastpac started, the daemon rewrites them after each sync
+        if config.get('metrics_file'):
+            metrics.REGISTRY.write_prometheus(config['metrics_file'])
+        if config.get('metrics_json'):
+            metrics.REGISTRY.write_json(config['metrics_json'])
+    return package_infos
+
+
+def sync_all(config, package_lists, dest, mirrorpicker, ledger=None, health=None, snapshot=None,
+             changed_only=False, store=None, limiter=None):
+    """
+    Download every package in the package lists, or with changed_only the ones
+    that changed since the snapshot. Returns the PackageIndex and the names of
+    every wanted package
+    """
+    # Built once so looking up a package never walks the repos or takes a lock
+    index = PackageIndex(config['databases'])
+    package_names = wanted_packages(config, index, package_lists)
+
+    scheduled = package_names
+    if changed_only:
+        changed = snapshot.changed(config['databases'], package_names)
+        log.info('%d of %d packages changed since the last run', len(changed), len(package_names))
+        scheduled = [name for name in package_names if name in changed]
+
+    package_infos = sync(config, index, scheduled, dest, mirrorpicker, ledger, health, store, limiter)
+
+    if snapshot:
+        # Packages that are not in place are tried again next time
+        failed = [info.name for info in package_infos if not (dest / info.filename).is_file()]
+        snapshot.update(config['databases'], package_names, failed)
+        snapshot.save()
+    return index, package_names
+
+
+def merge_databases(old, new):
+    """
+    Refreshed databases, keeping the earlier copy of every repo that could not
+    be fetched again. Repos are matched by position, the order of the config
+    """
+    old, new = list(old), list(new)
+    if len(old) != len(new):
+        return new
+
+    merged = []
+    for previous, current in zip(old, new):
+        if current is None and previous is not None:
+            log.warning('Could not refresh %r, keeping the copy from before', previous.name)
+            current = previous
+        merged.append(current)
+    return merged
+
+
+def run_daemon(args, config, package_lists, dest, mirrorpicker, ledger=None, health=None, snapshot=None,
+               store=None, limiter=None):
+    """
+    Keep the databases in memory, download packages as soon as they show up in
+    a package list and reload the databases every `refresh_interval` seconds
+    """
+    refresh_interval = config.get('refresh_interval', 3600)
+    watcher = ListWatcher(config['package_list_dir'], poll_interval=config.get('poll_interval', 5))
+    try:
+        index, known = sync_all(config, package_lists, dest, mirrorpicker, ledger, health, snapshot,
+                                args.changed_only, store, limiter)
+        known = set(known)
+        next_refresh = monotonic() + refresh_interval
+
+        while True:
+            changed = watcher.changes(timeout=max(0, next_refresh - monotonic()))
+            if changed:
+                log.info('Package lists changed: %s', ", ".join(path.name for path in changed))
+                package_names = wanted_packages(config, index, package_lists)
+                new = [name for name in package_names if name not in known]
+                if new:
+                    log.info('Downloading %d new packages', len(new))
+                    sync(config, index, new, dest, mirrorpicker, ledger, health, store, limiter)
+                    known.update(new)
+
+            if monotonic() >= next_refresh:
+                next_refresh = monotonic() + refresh_interval
+                # The config builds the databases, with cache_dir only changed ones are downloaded
+                log.info('Refreshing databases')
+                try:
+                    new_config = load_config(args.config_file)
+                except Exception as e:
+                    # A network error or a mistake in the config, the daemon keeps what it has
+                    log.error('Could not reload %s, trying again in %ss', args.config_file, refresh_interval,
+                              exc_info=e)
+                    continue
+
+                config['databases'] = merge_databases(config['databases'], new_config['databases'])
+                # Bandwidth limits can be changed without restarting
+                if limiter:
+                    limiter.set_rates(new_config.get('rate_limit'), new_config.get('mirror_rate_limit'))
+                index, known = sync_all(config, package_lists, dest, mirrorpicker, ledger, health, snapshot,
+                                        args.changed_only, store, limiter)
+                known = set(known)
+    finally:
+        watcher.close()
+
+
 def main(args: argparse.Namespace):
     config = load_config(args.config_file)
     if args.log_level:
         logging.getLogger('fastpac').setLevel(args.log_level.upper())
-    package_names = make_package_list(Path(config['package_list_dir']))
-    package_names = sorted(package_names)
 
-    databases_lock = Lock()
-    mirrorpicker_lock = Lock()
+    # Keep a connection open to each mirror for every worker
+    session.configure(pool_size=config['workers'])
 
     dest = Path(config['download_dir'])
 
     if not dest.is_dir():
         raise ValueError(f'download_dir {dest} is not a directory')
 
-    with ThreadPoolExecutorStackTraced(max_workers=config['workers']) as pool:
-        futures = []
-        for package_name in package_names:
-            futures.append(pool.submit(
-                download_package,
-                package_name,
-                dest,
-                config['databases'],
-                databases_lock,
-                config['mirrorpicker'],
-                mirrorpicker_lock,
-                config.get('architecture', 'x86_64')
-                ))
+    # Packages verified in earlier runs are not hashed again while unchanged
+    ledger = VerificationLedger(config['ledger_file']) if config.get('ledger_file') else None
+
+    # Packages shared with other download dirs and architectures are only downloaded once
+    store = ContentStore(config['store_dir']) if config.get('store_dir') else None
+
+    # Bandwidth shared by all downloads and by the downloads from each mirror, in bytes per second
+    limiter = RateLimiter(config.get('rate_limit'), config.get('mirror_rate_limit'))
+
+    # Remembers every repo after each run so the next one can skip what did not change
+    snapshot = RepoSnapshot(config['snapshot_file']) if config.get('snapshot_file') else None
+    if args.changed_only and snapshot is None:
+        raise ValueError('--changed-only needs snapshot_file in the config')
+
+    # Mirrors that keep failing are left out for a while
+    health = MirrorHealth(
+        threshold=config.get('mirror_failure_threshold', 3),
+        cooldown=config.get('mirror_cooldown', 60)
+        )
+    mirrorpicker = HealthyPicker(config['mirrorpicker'], health)
+
+    # Lists are read in parallel and only read again once they change
+    package_lists = PackageLists(config['package_list_dir'], workers=config.get('list_workers', 8))
 
-        for future in futures:
-            future.result()
+    if args.daemon:
+        run_daemon(args, config, package_lists, dest, mirrorpicker, ledger, health, snapshot, store, limiter)
+    else:
+        sync_all(config, package_lists, dest, mirrorpicker, ledger, health, snapshot, args.changed_only, store,
+                 limiter)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+"""
+asyncio download engine. Runs hundreds of downloads on one thread instead of
+a thread per download. Needs aiohttp (pip install fastpac[async])
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256 as new_sha256
+import logging
+from time import perf_counter
+
+try:
+    import aiohttp
+    have_aiohttp = True
+except ImportError:
+    have_aiohttp = False
+
+from fastpac.download import (Transfer, assemble_package_url, download_retries, finish_part, part_path,
+                               record_failure, record_transfer, resume_part, verify_package)
+
+log = logging.getLogger(__name__)
+
+
+class AsyncDownloader:
+    """
+    Downloads packages with at most `concurrency` transfers in flight and at
+    most `mirror_concurrency` to any one mirror. Uses the same mirror pickers
+    as the thread pool, they are only ever called from the event loop thread
+    """
+    def __init__(self, dest, mirrorpicker, arch='x86_64', ledger=None, concurrency=100,
+                 mirror_concurrency=8, hash_workers=2, attempts=3, health=None, backoff=1, max_backoff=60,
+                 timeout=None, chunk_size=2**16, store=None, limiter=None):
+        if not have_aiohttp:
+            raise RuntimeError('The asyncio engine needs aiohttp, install fastpac[async]')
+
+        self.dest = dest
+        self.mirrorpicker = mirrorpicker
+        self.arch = arch
+        self.ledger = ledger
+        self.concurrency = concurrency
+        self.mirror_concurrency = mirror_concurrency
+        self.hash_workers = hash_workers
+        self.attempts = attempts
+        self.health = health
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.store = store
+        self.limiter = limiter
+
+    def _mirror_limit(self, mirror):
+        if mirror not in self._mirror_limits:
+            self._mirror_limits[mirror] = asyncio.Semaphore(self.mirror_concurrency)
+        return self._mirror_limits[mirror]
+
+    async def download_file(self, session, url, path, sha256="", mirror=None):
+        """
+        The asyncio version of download.download_file_to_path, including resuming.
+        Returns a Transfer
+        """
+        partial = part_path(path)
+        limited = self.limiter and self.limiter.limited()
+        # Hashing what an earlier run got can take a while, it is done off the loop
+        offset, digest = await asyncio.get_running_loop().run_in_executor(self._hash_pool, resume_part, partial)
+
+        start = perf_counter()
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        async with session.get(url, headers=headers) as response:
+            latency = perf_counter() - start
+
+            # The earlier download already got every byte
+            if offset and response.status == 416:
+                finish_part(url, partial, path, digest, sha256)
+                return Transfer(url, 0, latency, perf_counter() - start)
+
+            response.raise_for_status()
+            if offset and response.status != 206:
+                log.info('%s does not support resuming, starting over', url)
+                offset, digest = 0, new_sha256()
+
+            transferred = 0
+            with open(partial, mode='ab' if offset else 'wb') as f:
+                async for part in response.content.iter_chunked(self.chunk_size):
+                    if limited:
+                        # Reserving never blocks, the wait is done on the loop
+                        wait = self.limiter.reserve(mirror, len(part))
+                        if wait:
+                            await asyncio.sleep(wait)
+                    f.write(part)
+                    digest.update(part)
+                    transferred += len(part)
+
+        finish_part(url, partial, path, digest, sha256)
+        return Transfer(url, transferred, latency, perf_counter() - start)
+
+    async def download_package(self, session, package_info):
+        """
+        Returns the Transfers it took, None if nothing was downloaded
+        """
+        filename = package_info.filename
+        file_path = self.dest / filename
+        loop = asyncio.get_running_loop()
+
+        if self.ledger and self.ledger.is_verified(file_path, package_info.sha256):
+            log.debug('%r already verified', filename)
+            return
+
+        # Hashing is done off the event loop
+        if file_path.is_file():
+            if await loop.run_in_executor(self._hash_pool, verify_package, package_info, file_path, self.ledger):
+                if self.store and package_info.sha256:
+                    await loop.run_in_executor(self._hash_pool, self.store.add, package_info.sha256, file_path)
+                return
+            # It may have been a hardlink of the store entry
+            if self.store and package_info.sha256:
+                await loop.run_in_executor(self._hash_pool, self.store.evict, package_info.sha256)
+
+        # Downloaded before for another download_dir or architecture, copying can block so it is done off the loop.
+        # It is left out of the ledger so the next run hashes it once
+        if self.store and package_info.sha256:
+            if await loop.run_in_executor(self._hash_pool, self.store.fetch, package_info.sha256, file_path):
+                return
+
+        async with self._limit:
+            for attempt in range(self.attempts):
+                if attempt:
+                    download_retries.inc()
+                    await asyncio.sleep(min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
+
+                size = int(package_info.size)
+                mirror = self.mirrorpicker.next(size=size)
+                package_mirror = mirror
+
+                try:
+                    # A picker out of mirrors gives None, that fails here like any other download
+                    package_mirror = assemble_package_url(package_info, mirror, arch=self.arch)
+                    log.info('Downloading %r from %s', filename, package_mirror)
+                    async with self._mirror_limit(mirror):
+                        transfer = await self.download_file(session, package_mirror, file_path,
+                                                            sha256=package_info.sha256, mirror=mirror)
+                except Exception as e:
+                    log.warning('Downloading %r from %s failed: %r', filename, package_mirror, e)
+                    record_failure(mirror)
+                    if self.health:
+                        self.health.failure(mirror)
+                    if hasattr(self.mirrorpicker, 'report_failure'):
+                        self.mirrorpicker.report_failure(mirror, size)
+                    # Go to next mirror
+                    continue
+
+                record_transfer(mirror, transfer)
+                if self.health:
+                    self.health.success(mirror)
+                # Pickers that learn from finished downloads
+                if hasattr(self.mirrorpicker, 'report'):
+                    self.mirrorpicker.report(mirror, size, transfer.seconds, transfer.latency, transfer.size)
+                if self.ledger and package_info.sha256:
+                    self.ledger.record(file_path, package_info.sha256)
+                if self.store and package_info.sha256:
+                    await loop.run_in_executor(self._hash_pool, self.store.add, package_info.sha256, file_path)
+                log.info('Finished downloading %s', package_mirror)
+                return [transfer]
+
+        log.error('Giving up on %r after %d attempts', filename, self.attempts)
+        return None
+
+    async def download_packages(self, package_infos):
+        self._limit = asyncio.Semaphore(self.concurrency)
+        self._mirror_limits = {}
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.mirror_concurrency)
+        # Like the thread engine the timeout is for the mirror going quiet, not the whole download
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        with ThreadPoolExecutor(max_workers=self.hash_workers) as self._hash_pool:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                results = await asyncio.gather(*(self.download_package(session, package_info)
+                                                 for package_info in package_infos))
+        return [result for result in results if result]
+
+    def run(self, package_infos):
+        """
+        Download every package, blocking until they are all done. Downloads
+        start in the order given. Returns the Transfers of each package that
+        was downloaded
+        """
+        return asyncio.run(self.download_packages(package_infos))
@@ -0,0 +1,82 @@
+"""
+On disk cache of parsed repo databases
+"""
+from hashlib import sha256
+import logging
+from pathlib import Path
+import pickle
+from typing import NamedTuple, Optional
+
+from fastpac.database import Database, Repo
+from fastpac.util import atomic_write
+
+log = logging.getLogger(__name__)
+
+
+class CachedRepo(NamedTuple):
+    url: str
+    etag: str
+    last_modified: str
+    db: Repo
+
+
+class RepoCache:
+    """
+    Parsed repo databases pickled to a directory, one file per database url
+    (so per repo and mirror)
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def _entry_path(self, url):
+        return self.path / (sha256(url.encode()).hexdigest() + ".pickle")
+
+    def _database_path(self, url):
+        return self.path / (sha256(url.encode()).hexdigest() + ".db")
+
+    def load(self, url) -> Optional[CachedRepo]:
+        try:
+            with open(self._entry_path(url), mode='rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning('Ignoring unreadable cache entry for %r', url, exc_info=e)
+            return None
+
+        # A hash collision or a cache from an unrelated url
+        if entry.url != url:
+            return None
+        return entry
+
+    def store(self, entry: CachedRepo):
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self._entry_path(entry.url)
+
+        # A crash never leaves a half written entry behind
+        with atomic_write(path, mode='wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def store_database(self, url, content) -> Database:
+        """
+        Keep the database file of url as downloaded. Returns it as a Database
+        for the records parsed from it
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self._database_path(url)
+        with atomic_write(path, mode='wb') as f:
+            f.write(content)
+        return Database(path=path)
+
+    def validators(self, entry: Optional[CachedRepo]):
+        """
+        HTTP headers that make a request conditional on the entry being out of date
+        """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
@@ -1,16 +1,22 @@
+from io import BytesIO
+import re
+import sys
 import tarfile
 
 class Repo:
-    def __init__(self, data):
+    def __init__(self, data, database=None):
+        """
+        data is a dict or a TarFile of a repo database. Only the fields fastpac
+        uses are kept, the others are read again from `database` (a Database)
+        when they are asked for
+        """
         self.data = {}
         if isinstance(data, dict):
             self.data = data
         elif isinstance(data, tarfile.TarFile):
-            for member in data.getmembers():
-                if member.name.endswith("/desc"):
-                    raw_desc = data.extractfile(member).read()
-                    dict_desc = package_desc2dict(raw_desc)
-                    self.data = {**self.data, **dict_desc}
+            for raw_desc in iter_desc(data):
+                record = PackageRecord.from_desc(raw_desc, database)
+                self.data[record.name] = record
 
 
     def __iter__(self):
@@ -20,10 +26,210 @@ class Repo:
     def __getitem__(self, key):
         return self.data[key]
 
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
     def __eq__(self, other):
         return self.data == other.data
 
 
+class Database:
+    """
+    A repo database file, on disk at path or held as its compressed bytes in
+    data. Records read the fields they did not keep from it
+    """
+    __slots__ = ("path", "data")
+
+    def __init__(self, path=None, data=None):
+        self.path = str(path) if path is not None else None
+        self.data = data
+
+    def open(self):
+        if self.path is not None:
+            return tarfile.open(self.path)
+        return tarfile.open(fileobj=BytesIO(self.data))
+
+    def desc(self, name):
+        """
+        The raw desc of the package name, None if the database does not have it
+        """
+        with self.open() as tar:
+            return find_desc(tar, name)
+
+
+class PackageRecord:
+    """
+    A package from a repo database holding only the fields fastpac uses. The
+    rest of the desc is parsed again from its Database when one of its fields
+    is asked for, a record without one keeps its desc
+    """
+    __slots__ = ("name", "filename", "csize", "_sha256", "depend_names", "provide_names",
+                 "replace_names", "_source")
+
+    def __init__(self, name, filename, csize, sha256sum="", depend_names=(), provide_names=(),
+                 replace_names=(), desc=b"", database=None):
+        self.name = name
+        self.filename = filename
+        self.csize = csize
+        self.sha256sum = sha256sum
+        # Names only, version constraints are dropped
+        self.depend_names = depend_names
+        self.provide_names = provide_names
+        self.replace_names = replace_names
+        # One Database shared by a whole repo instead of a desc per package
+        self._source = database if database is not None else desc
+
+    @property
+    def sha256sum(self):
+        sha256 = self._sha256
+        return sha256.hex() if isinstance(sha256, bytes) else sha256
+
+    @sha256sum.setter
+    def sha256sum(self, value):
+        # 32 bytes instead of a 64 character string
+        try:
+            self._sha256 = bytes.fromhex(value)
+        except ValueError:
+            self._sha256 = value
+
+    @classmethod
+    def from_desc(cls, desc, database=None):
+        fields = desc_fields(desc, ("name", "filename", "csize", "sha256sum", "depends", "provides",
+                                    "replaces"))
+        return cls(
+            name=fields["name"],
+            filename=fields.get("filename", ""),
+            csize=int(fields.get("csize", 0)),
+            sha256sum=fields.get("sha256sum", ""),
+            depend_names=relation_names(fields.get("depends", "")),
+            provide_names=relation_names(fields.get("provides", "")),
+            replace_names=relation_names(fields.get("replaces", "")),
+            desc=b"" if database is not None else desc,
+            database=database
+        )
+
+    def desc(self):
+        """
+        The desc as it was in the database
+        """
+        if isinstance(self._source, Database):
+            return self._source.desc(self.name) or b""
+        return self._source
+
+    def fields(self):
+        """
+        Every field of the desc, parsed
+        """
+        desc = self.desc()
+        if not desc:
+            return {"filename": self.filename, "csize": str(self.csize), "sha256sum": self.sha256sum}
+        return package_desc2dict(desc)[self.name]
+
+    # Same access as the dicts of an artificial Repo
+    def __getitem__(self, key):
+        if key in ("filename", "csize", "sha256sum"):
+            return getattr(self, key)
+        return self.fields()[key]
+
+    def __contains__(self, key):
+        if key == "sha256sum":
+            return bool(self.sha256sum)
+        return key in ("filename", "csize") or key in self.fields()
+
+    def __eq__(self, other):
+        if not isinstance(other, PackageRecord):
+            return NotImplemented
+        return (self.name, self.filename, self.csize, self.sha256sum, self.depend_names, self.provide_names,
+                self.replace_names) == \
+            (other.name, other.filename, other.csize, other.sha256sum, other.depend_names, other.provide_names,
+             other.replace_names)
+
+    def __repr__(self):
+        return f"PackageRecord(name={self.name!r}, filename={self.filename!r}, csize={self.csize!r})"
+
+
+_version_constraint = re.compile("[<>=]")
+
+
+def relation_names(value):
+    """
+    Package names out of a depends, provides or replaces field
+
+    "glibc>=2.3\nsh" -> ("glibc", "sh")
+    """
+    if not value:
+        return ()
+    # The same few names are depended on by thousands of packages
+    return tuple(sys.intern(_version_constraint.split(line, 1)[0]) for line in value.split("\n"))
+
+
+def package_relations(package):
+    """
+    Names a package depends on, provides and replaces. Works with records and
+    with the dicts of an artificial Repo
+    """
+    if isinstance(package, PackageRecord):
+        return package.depend_names, package.provide_names, package.replace_names
+    return tuple(relation_names(package.get(key, "")) for key in ("depends", "provides", "replaces"))
+
+
+def iter_desc(tar):
+    """
+    Yield the raw contents of every package desc file in a repo tar, one
+    member at a time
+    """
+    member = tar.next()
+    while member is not None:
+        if member.isfile() and member.name.endswith("/desc"):
+            yield tar.extractfile(member).read()
+
+        # TarFile remembers every member it has read, forget them so memory
+        # does not grow with the size of the repo
+        tar.members = []
+        member = tar.next()
+
+
+def find_desc(tar, name):
+    """
+    The raw desc of the package name in a repo tar, None if it is not there
+    """
+    member = tar.next()
+    while member is not None:
+        # Members are named <name>-<pkgver>-<pkgrel>/desc, neither pkgver nor pkgrel has a -
+        directory, _, file_name = member.name.rpartition("/")
+        if member.isfile() and file_name == "desc" and directory.rsplit("-", 2)[0] == name:
+            desc = tar.extractfile(member).read()
+            if desc_fields(desc, ("name",)).get("name") == name:
+                return desc
+        tar.members = []
+        member = tar.next()
+    return None
+
+
+def desc_fields(desc, wanted):
+    """
+    Parse only the wanted fields out of a package desc file
+    """
+    fields = {}
+    key = None
+    for line in desc.decode().split("\n"):
+        line = line.strip(" ")
+        if not line:
+            continue
+
+        if line.startswith("%") and line.endswith("%"):
+            key = line.strip("%").lower()
+            if key in wanted:
+                fields[key] = []
+        elif key in fields:
+            fields[key].append(line)
+
+    return {key: "\n".join(value) for key, value in fields.items()}
+
+
 def package_desc2dict(desc):
     # Bytes to String
     desc = desc.decode()
@@ -1,13 +1,350 @@
-from requests import get as get_url
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256 as new_sha256
+import logging
+import os
+from os import remove as remove_file
+from threading import local
+from time import perf_counter
+from typing import NamedTuple
+
+from fastpac import metrics
+from fastpac.session import get as get_url
+
+log = logging.getLogger(__name__)
+
+download_bytes = metrics.counter('fastpac_download_bytes_total', 'Bytes downloaded', ('mirror',))
+download_seconds = metrics.histogram('fastpac_download_seconds', 'Time to download a file or range', ('mirror',))
+download_latency = metrics.histogram('fastpac_download_latency_seconds', 'Time until a download starts',
+                                     ('mirror',))
+download_failures = metrics.counter('fastpac_download_failures_total', 'Downloads that failed', ('mirror',))
+download_retries = metrics.counter('fastpac_download_retries_total', 'Downloads tried again')
+hash_seconds = metrics.histogram('fastpac_hash_seconds', 'Time to hash a file that is on disk')
+hashed_bytes = metrics.counter('fastpac_hashed_bytes_total', 'Bytes of files on disk hashed')
+
+
+class HashMismatchError(Exception):
+    """
+    A downloaded file does not have the hash the repo database lists for it
+    """
+
+
+def record_transfer(mirror, transfer):
+    """
+    Count a finished download of mirror
+    """
+    download_bytes.inc(transfer.size, mirror=mirror)
+    download_seconds.observe(transfer.seconds, mirror=mirror)
+    download_latency.observe(transfer.latency, mirror=mirror)
+
+
+def record_failure(mirror):
+    download_failures.inc(mirror=mirror)
+
+
+class Transfer(NamedTuple):
+    """
+    What a finished download cost: bytes sent by the mirror, seconds until the
+    response started and seconds in total
+    """
+    url: str
+    size: int
+    latency: float
+    seconds: float
 
 
 def assemble_package_url(package_info, base_url, arch):
     return "/".join((base_url.strip("/"), package_info.repo, f'os/{arch}', package_info.filename))
 
 
-def download_file_to_path(url, path):
-    request = get_url(url, stream=True)
-    with open(path, mode='bw') as f:
-        for part in request.iter_content(chunk_size=1024):
-            if part:
-                f.write(part)
+def hash_file(path, chunk_size=2**20):
+    """
+    sha256 of a file read a chunk at a time so big packages never have to fit in memory
+    """
+    digest = new_sha256()
+    with hash_seconds.time(), open(path, mode='rb') as f:
+        for part in iter(lambda: f.read(chunk_size), b""):
+            digest.update(part)
+            hashed_bytes.inc(len(part))
+    return digest.hexdigest()
+
+
+def part_path(path):
+    """
+    Where a download is written until it is complete and verified
+    """
+    return path.with_name(path.name + ".part")
+
+
+def resume_part(partial):
+    """
+    How far a previous download got and the sha256 of the bytes it got
+    """
+    digest = new_sha256()
+    if not partial.is_file():
+        return 0, digest
+
+    with open(partial, mode='rb') as f:
+        for part in iter(lambda: f.read(2**20), b""):
+            digest.update(part)
+    return partial.stat().st_size, digest
+
+
+def finish_part(url, partial, path, digest, sha256):
+    """
+    Move a complete download in place if it has the right hash
+    """
+    if sha256 and digest.hexdigest() != sha256:
+        remove_file(partial)
+        raise HashMismatchError(f'{url} has sha256 {digest.hexdigest()}, expected {sha256}')
+    os.replace(partial, path)
+
+
+# Size of the reads and writes of a download
+BUFFER_SIZE = 2**20
+
+_buffers = local()
+
+
+def thread_buffer():
+    """
+    A buffer of BUFFER_SIZE bytes for this thread, reused by all its downloads
+    """
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None or len(buffer) != BUFFER_SIZE:
+        buffer = _buffers.buffer = memoryview(bytearray(BUFFER_SIZE))
+    return buffer
+
+
+# Size of the reads of a rate limited download, smaller so it is smooth
+THROTTLE_READ_SIZE = 2**16
+
+
+def copy_response(response, write, digest=None, throttle=None):
+    """
+    Read the body of a streamed response straight into a reusable buffer and
+    hand it to write a full buffer at a time, instead of a bytes object per
+    chunk. Falls back to iter_content when the body has to be decoded.
+    throttle is called with the size of every read, see ratelimit.RateLimiter.
+    Returns the number of bytes
+    """
+    read_size = THROTTLE_READ_SIZE if throttle else BUFFER_SIZE
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        transferred = 0
+        for part in response.iter_content(chunk_size=read_size):
+            if throttle:
+                throttle(len(part))
+            write(part)
+            if digest:
+                digest.update(part)
+            transferred += len(part)
+        return transferred
+
+    buffer = thread_buffer()
+    read_into = response.raw.readinto
+    transferred = 0
+    while True:
+        filled = 0
+        try:
+            while filled < len(buffer):
+                count = read_into(buffer[filled:filled + read_size])
+                if not count:
+                    break
+                if throttle:
+                    throttle(count)
+                filled += count
+        finally:
+            # Also when the connection broke, what was read is kept to resume from
+            if filled:
+                write(buffer[:filled])
+                if digest:
+                    digest.update(buffer[:filled])
+
+        transferred += filled
+        if filled < len(buffer):
+            return transferred
+
+
+def write_all(f):
+    """
+    A write function for copy_response that writes everything to the unbuffered file f
+    """
+    def write(data):
+        while data:
+            data = data[f.write(data):]
+    return write
+
+
+def download_file_to_path(url, path, sha256="", timeout=None, preallocate=False, throttle=None):
+    """
+    Download url to path. The file is written to path.part first and
+    resumed from there if an earlier download was interrupted. If sha256 is
+    given the file is hashed as it arrives and thrown away if it does not match.
+    timeout is how long to wait for the mirror to send anything before giving up.
+    With preallocate the whole file is allocated up front so it is not fragmented.
+    throttle limits the bandwidth, see copy_response.
+    Returns a Transfer
+    """
+    partial = part_path(path)
+    offset, digest = resume_part(partial)
+
+    start = perf_counter()
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    request = get_url(url, headers=headers, stream=True, timeout=timeout)
+    latency = perf_counter() - start
+
+    # The earlier download already got every byte
+    if offset and request.status_code == 416:
+        request.close()
+        finish_part(url, partial, path, digest, sha256)
+        return Transfer(url, 0, latency, perf_counter() - start)
+
+    request.raise_for_status()
+    if offset and request.status_code != 206:
+        log.info('%s does not support resuming, starting over', url)
+        offset, digest = 0, new_sha256()
+    elif offset:
+        log.info('Resuming %s from byte %d', url, offset)
+
+    # Unbuffered, copy_response already writes big blocks
+    with open(partial, mode='r+b' if offset else 'wb', buffering=0) as f:
+        f.seek(offset)
+        length = int(request.headers.get("Content-Length", 0))
+        if preallocate and length:
+            os.posix_fallocate(f.fileno(), offset, length)
+
+        try:
+            transferred = copy_response(request, write_all(f), digest, throttle)
+        finally:
+            # Preallocated space that was never written must not look downloaded when resuming
+            f.truncate(f.tell())
+
+    finish_part(url, partial, path, digest, sha256)
+    return Transfer(url, transferred, latency, perf_counter() - start)
+
+
+def split_ranges(size, segments):
+    """
+    Split size bytes into inclusive byte ranges of nearly the same length
+
+    split_ranges(10, 3) -> [(0, 3), (4, 6), (7, 9)]
+    """
+    segments = max(1, min(segments, size))
+    length, extra = divmod(size, segments)
+    ranges = []
+    start = 0
+    for num in range(segments):
+        end = start + length + (num < extra)
+        ranges.append((start, end - 1))
+        start = end
+    return ranges
+
+
+def download_range(url, fd, start, end, timeout=None, throttle=None):
+    """
+    Download bytes start to end (inclusive) of url and write them at the same
+    offset in the file open as fd
+    """
+    started = perf_counter()
+    request = get_url(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=timeout)
+    latency = perf_counter() - started
+    request.raise_for_status()
+    if request.status_code != 206:
+        raise IOError(f'{url} does not support range requests')
+
+    offset = start
+
+    def write(data):
+        nonlocal offset
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+
+    copy_response(request, write, throttle=throttle)
+    if offset != end + 1:
+        raise IOError(f'{url} sent bytes {start}-{offset - 1}, expected {start}-{end}')
+    return Transfer(url, end + 1 - start, latency, perf_counter() - started)
+
+
+def download_file_segmented(urls, path, size, sha256="", timeout=None, preallocate=False, throttles=None):
+    """
+    Download a file in one byte range per url, all at the same time, into a
+    file preallocated to its final size. A range that fails is tried again
+    from the other urls. If sha256 is given the whole file is checked at the end.
+    Like download_file_to_path it is written to path.part and moved in place once done.
+    With preallocate the blocks are allocated up front instead of leaving holes.
+    throttles are the throttle of each url, see copy_response.
+    Returns a Transfer per range
+    """
+    partial = part_path(path)
+    with open(partial, mode='bw') as f:
+        f.truncate(size)
+
+    def fetch(num, start, end):
+        # Start on this segment's own url then fall back to the others
+        for index in list(range(num, len(urls))) + list(range(num)):
+            url = urls[index]
+            throttle = throttles[index] if throttles else None
+            try:
+                return download_range(url, fd, start, end, timeout=timeout, throttle=throttle)
+            except Exception as e:
+                log.warning('Downloading bytes %d-%d from %s failed: %r', start, end, url, e)
+                error = e
+        raise error
+
+    fd = os.open(partial, os.O_WRONLY)
+    try:
+        if preallocate:
+            os.posix_fallocate(fd, 0, size)
+        with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+            ranges = split_ranges(size, len(urls))
+            futures = [pool.submit(fetch, num, start, end) for num, (start, end) in enumerate(ranges)]
+            transfers = [future.result() for future in futures]
+    except Exception:
+        # The ranges that did arrive can not be told apart from the holes
+        os.close(fd)
+        remove_file(partial)
+        raise
+    os.close(fd)
+
+    if sha256:
+        current_hash = hash_file(partial)
+        if current_hash != sha256:
+            remove_file(partial)
+            raise HashMismatchError(f'{path} has sha256 {current_hash}, expected {sha256}')
+    os.replace(partial, path)
+    return transfers
+
+
+def verify_package(package_info, file_path, ledger=None) -> bool:
+    """
+    Check a package that is already present against the hash from the repo.
+    Removes it and returns False if it has to be downloaded again
+    """
+    name = package_info.name
+    log.info('%r already exists', package_info.filename)
+    log.debug("file_path %r", file_path)
+
+    # If the sha256 hash is not provided skip
+    if not package_info.sha256:
+        return True
+
+    # Hash from repo
+    remote_hash = package_info.sha256
+
+    # Calculate current file's hash
+    current_hash = hash_file(file_path)
+
+    # Hashs match skip package
+    log.debug("Remote hash %r", remote_hash)
+    log.debug("Local hash  %r", current_hash)
+    if remote_hash == current_hash:
+        log.info("%r has matching hashs", name)
+        if ledger:
+            ledger.record(file_path, current_hash)
+        return True
+
+    log.warning("Local package file %r does not have matching hashs", name)
+    remove_file(file_path)
+    log.info("Removed local copy of package %r", file_path)
+    return False
@@ -0,0 +1,88 @@
+"""
+Tracking which mirrors are failing so they can be left out for a while
+"""
+from inspect import signature
+from threading import Lock
+from time import monotonic
+
+
+class MirrorHealth:
+    """
+    A circuit breaker per mirror. After `threshold` failures in a row a mirror
+    is left out for `cooldown` seconds. If it fails again right after coming
+    back it is left out twice as long, up to `max_cooldown`
+    """
+    def __init__(self, threshold=3, cooldown=60, max_cooldown=3600, clock=monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._clock = clock
+        self._lock = Lock()
+        # mirror -> failures in a row
+        self._failures = {}
+        # mirror -> times the circuit opened without a success in between
+        self._trips = {}
+        # mirror -> when it can be used again
+        self._open_until = {}
+
+    def available(self, mirror) -> bool:
+        with self._lock:
+            return self._open_until.get(mirror, 0) <= self._clock()
+
+    def success(self, mirror):
+        with self._lock:
+            self._failures.pop(mirror, None)
+            self._trips.pop(mirror, None)
+            self._open_until.pop(mirror, None)
+
+    def failure(self, mirror):
+        with self._lock:
+            failures = self._failures.get(mirror, 0) + 1
+            self._failures[mirror] = failures
+
+            # A mirror that just came back gets one try before being left out again
+            if failures >= self.threshold or mirror in self._trips:
+                trips = self._trips.get(mirror, 0)
+                self._trips[mirror] = trips + 1
+                self._open_until[mirror] = self._clock() + min(self.cooldown * 2 ** trips, self.max_cooldown)
+                self._failures[mirror] = 0
+
+    def unavailable(self):
+        """
+        Mirrors currently left out
+        """
+        now = self._clock()
+        with self._lock:
+            return [mirror for mirror, until in self._open_until.items() if until > now]
+
+
+class HealthyPicker:
+    """
+    Wraps another mirror picker and skips the mirrors that are left out.
+    Pickers that take exclude (every one in fastpac.picker) are told which
+    mirrors to skip. Others are asked again, and if they keep handing out
+    unavailable mirrors the last one is used anyway rather than stopping the
+    download
+    """
+    def __init__(self, picker, health, tries=16):
+        self.picker = picker
+        self.health = health
+        self.tries = tries
+        self._exclude = "exclude" in signature(picker.next).parameters
+
+    def next(self, size=0):
+        if self._exclude:
+            return self.picker.next(size=size, exclude=set(self.health.unavailable()))
+
+        for num in range(self.tries):
+            mirror = self.picker.next(size=size)
+            if mirror is None or self.health.available(mirror) or num == self.tries - 1:
+                return mirror
+
+            # Hand the work back to pickers that keep track of it
+            if hasattr(self.picker, 'report_failure'):
+                self.picker.report_failure(mirror, size)
+
+    def __getattr__(self, name):
+        # get_mirrors, remove and anything else the wrapped picker has
+        return getattr(self.picker, name)
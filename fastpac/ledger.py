@@ -0,0 +1,74 @@
+"""
+Record of package files that have already been verified
+"""
+import json
+import logging
+from pathlib import Path
+from threading import Lock
+
+from fastpac.util import atomic_write
+
+log = logging.getLogger(__name__)
+
+
+class VerificationLedger:
+    """
+    Remembers the sha256 of files that were hashed along with their size,
+    mtime and inode at the time. While those have not changed the file is
+    trusted without reading it again
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = Lock()
+        self._entries = {}
+
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            log.warning('Ignoring unreadable ledger %s', self.path, exc_info=e)
+
+    @staticmethod
+    def _stat(file_path):
+        stat = Path(file_path).stat()
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def is_verified(self, file_path, sha256) -> bool:
+        """
+        Whether file_path was verified to have sha256 and has not changed since
+        """
+        with self._lock:
+            entry = self._entries.get(str(file_path))
+        if entry is None or entry[3] != sha256:
+            return False
+
+        try:
+            return self._stat(file_path) == entry[:3]
+        except FileNotFoundError:
+            return False
+
+    def record(self, file_path, sha256):
+        """
+        Remember that file_path currently has sha256
+        """
+        entry = self._stat(file_path) + [sha256]
+        with self._lock:
+            self._entries[str(file_path)] = entry
+
+    def forget(self, file_path):
+        with self._lock:
+            self._entries.pop(str(file_path), None)
+
+    def save(self):
+        """
+        Write the ledger to disk, dropping files that no longer exist
+        """
+        with self._lock:
+            entries = {path: entry for path, entry in self._entries.items() if Path(path).exists()}
+            self._entries = entries
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.path) as f:
+            json.dump(entries, f)
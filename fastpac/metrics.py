@@ -0,0 +1,224 @@
+"""
+Counters and histograms of where a run spends its time, written out as a
+Prometheus text file (for node_exporter's textfile collector) or as JSON.
+
+Modules make their metrics once at import, the same way they get a logger:
+
+    fetch_seconds = metrics.histogram('fastpac_repo_fetch_seconds', 'Time to fetch a repo', ('repo',))
+    fetch_seconds.observe(1.2, repo='core')
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+from threading import Lock
+from time import perf_counter
+
+from fastpac.util import atomic_write
+
+# Seconds, from a lookup to a big package on a slow mirror
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, registry, name, help, labels=()):
+        self._registry = registry
+        self._lock = Lock()
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Label values in the order of self.labels -> value
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _notify(self, value, labels):
+        for callback in self._registry.subscribers(self.name):
+            callback(value, labels)
+
+
+class Counter(Metric):
+    """
+    A total that only goes up
+    """
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self._notify(amount, labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def summary(self):
+        with self._lock:
+            return [{"labels": dict(zip(self.labels, key)), "value": value} for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """
+    How many values fell in each bucket, with their sum
+    """
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Values above the last bucket go in the extra +Inf bucket
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Count per bucket, then sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+        self._notify(value, labels)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe how long the with block took
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        counts = self._values.get(self._key(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def sum(self, **labels):
+        counts = self._values.get(self._key(labels))
+        return counts[-1] if counts else 0.0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                samples.append((self.name + "_bucket", key + (("le", format_value(bound)),), cumulative))
+            samples.append((self.name + "_sum", key, counts[-1]))
+            samples.append((self.name + "_count", key, cumulative))
+        return samples
+
+    def summary(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        summary = []
+        for key, counts in values:
+            count = sum(counts[:-1])
+            summary.append({
+                "labels": dict(zip(self.labels, key)),
+                "count": count,
+                "sum": counts[-1],
+                "mean": counts[-1] / count if count else 0.0,
+            })
+        return summary
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Registry:
+    """
+    All the metrics of a process. Callbacks can subscribe to a metric by name
+    and are called with every value and its labels, for example by a mirror
+    picker that wants to learn from transfer times
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics = {}
+        self._subscribers = {}
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(self, name, help, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'{name} is already a {metric.type}')
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def subscribe(self, name, callback):
+        with self._lock:
+            # Copied so subscribers() never needs the lock
+            self._subscribers[name] = self._subscribers.get(name, ()) + (callback,)
+
+    def unsubscribe(self, name, callback):
+        with self._lock:
+            self._subscribers[name] = tuple(c for c in self._subscribers.get(name, ()) if c != callback)
+
+    def subscribers(self, name):
+        return self._subscribers.get(name, ())
+
+    def to_prometheus(self):
+        """
+        Every metric in the Prometheus text format
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, key, value in metric.samples():
+                labels = list(zip(metric.labels, key))
+                # Histogram buckets have le after the other labels
+                labels += list(key[len(metric.labels):])
+                if labels:
+                    pairs = ",".join(f'{label}="{escape(str(label_value))}"' for label, label_value in labels)
+                    lines.append(f"{name}{{{pairs}}} {format_value(value)}")
+                else:
+                    lines.append(f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Every metric as something json.dump can write
+        """
+        return {metric.name: {"type": metric.type, "help": metric.help, "values": metric.summary()}
+                for metric in list(self._metrics.values())}
+
+    # A collector reading the file never sees half of it
+    def write_prometheus(self, path):
+        with atomic_write(path) as f:
+            f.write(self.to_prometheus())
+
+    def write_json(self, path):
+        with atomic_write(path) as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# The registry of this process
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+subscribe = REGISTRY.subscribe
@@ -1,10 +1,26 @@
-from requests import get as get_response
-from fastpac.util import aslist
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 import json
+import logging
+from pathlib import Path
+from time import perf_counter, time
+from typing import NamedTuple, Optional
+
+from fastpac.session import get as get_response, get_session
+from fastpac.util import aslist, atomic_write
+
+log = logging.getLogger(__name__)
+
 
 def get(url):
     return get_response(url).content
 
+
+def head(url, timeout=None):
+    response = get_session().head(url, timeout=timeout, allow_redirects=True)
+    response.raise_for_status()
+    return response
+
 def is_mirror_https(mirror):
     # Explicit param
     if "protocol" in mirror:
@@ -52,3 +68,101 @@ def parse_mirrorlist(raw_text):
 def get_mirrorlist_offline(path="/etc/pacman.d/mirrorlist"):
     with open(path) as f:
         return [e for e in parse_mirrorlist(f.read()) if is_mirror_https({"url": e})]
+
+
+class ProbeResult(NamedTuple):
+    mirror: str
+    # Seconds for the mirror to answer
+    latency: float
+    # When the mirror's database last changed (unix time), None if unknown
+    last_modified: Optional[float]
+
+
+def probe_mirror(mirror, repo="core", arch="x86_64", timeout=5) -> Optional[ProbeResult]:
+    """
+    Time a HEAD request for a repo database on a mirror. None if it failed
+    """
+    url = "/".join((mirror.strip("/"), repo, "os", arch, f"{repo}.db"))
+    start = perf_counter()
+    try:
+        response = head(url, timeout=timeout)
+    except Exception as e:
+        log.info('Probing %s failed: %r', url, e)
+        return None
+    latency = perf_counter() - start
+
+    last_modified = None
+    if response.headers.get("Last-Modified"):
+        try:
+            last_modified = parsedate_to_datetime(response.headers["Last-Modified"]).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return ProbeResult(mirror, latency, last_modified)
+
+
+def load_probe_cache(path, mirrors, ttl):
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # Only good for the same candidates and while it is fresh
+    if cached.get("candidates") != mirrors or cached.get("time", 0) + ttl < time():
+        return None
+    return cached["mirrors"]
+
+
+def store_probe_cache(path, mirrors, ranked):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(path) as f:
+        json.dump({"time": time(), "candidates": mirrors, "mirrors": ranked}, f)
+
+
+def probe_mirrors(mirrors, top=None, repo="core", arch="x86_64", timeout=5, workers=16, max_lag=3600,
+                  cache_file=None, ttl=3600):
+    """
+    Probe mirrors at the same time and rank them by how fast they answer.
+
+    Mirrors that do not answer are dropped, and so are mirrors whose database
+    is more than max_lag seconds older than the newest one seen (they are out of
+    sync and would not have the current packages). If no mirror answers they are
+    all returned as given and the ranking is not cached
+
+    Arguments:
+        mirrors: candidate mirrors
+        top: only keep this many of the fastest mirrors
+        cache_file: remember the ranking here for ttl seconds
+    """
+    mirrors = list(mirrors)
+    if cache_file:
+        cached = load_probe_cache(cache_file, mirrors, ttl)
+        if cached is not None:
+            log.info('Using mirror ranking from %s', cache_file)
+            return cached[:top]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = [result for result in pool.map(
+            lambda mirror: probe_mirror(mirror, repo=repo, arch=arch, timeout=timeout), mirrors) if result]
+
+    newest = max((result.last_modified for result in results if result.last_modified), default=None)
+    if newest is not None:
+        in_sync = [result for result in results
+                   if result.last_modified is None or result.last_modified >= newest - max_lag]
+        for result in results:
+            if result not in in_sync:
+                log.info('%s is out of sync, dropping it', result.mirror)
+        results = in_sync
+
+    ranked = [result.mirror for result in sorted(results, key=lambda result: result.latency)]
+    log.info('%d of %d mirrors are usable', len(ranked), len(mirrors))
+
+    # Most likely the network is down, not every mirror. Keep them all and probe again next run
+    if not ranked:
+        log.warning('No mirror answered, using them unranked')
+        return mirrors[:top]
+
+    if cache_file:
+        store_probe_cache(cache_file, mirrors, ranked)
+    return ranked[:top]
@@ -0,0 +1,84 @@
+"""
+Reading the package lists agents put in package_list_dir
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+from pathlib import Path
+import sys
+from typing import FrozenSet, Iterator
+
+log = logging.getLogger(__name__)
+
+
+def read_package_list(path: Path) -> FrozenSet[str]:
+    """
+    Package names in a list from `pacman -Q`, one package per line with
+    its version after a space
+    """
+    with path.open('r') as f:
+        names = {line.partition(' ')[0] for line in f.read().splitlines()}
+    names.discard('')
+    # Most hosts list the same packages, keep one copy of each name
+    return frozenset(map(sys.intern, names))
+
+
+class PackageLists:
+    """
+    The package lists in a directory. What each file contained is kept with
+    its modification time so a file is only read again after it changed
+    """
+    def __init__(self, path, workers=8):
+        self.path = Path(path)
+        self.workers = workers
+        # path -> (mtime_ns, size, names)
+        self._files = {}
+
+    def _stat(self):
+        stats = {}
+        for child in self.path.iterdir():
+            try:
+                stat = child.stat()
+            except FileNotFoundError:
+                continue
+            stats[child] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def iter_names(self) -> Iterator[str]:
+        """
+        Yield every package name in the lists once. Names from unchanged files
+        come first, the rest as soon as the file they are in has been read
+        """
+        stats = self._stat()
+        # Lists that were removed
+        for path in self._files.keys() - stats.keys():
+            del self._files[path]
+
+        seen = set()
+        changed = []
+        for path, stat in stats.items():
+            cached = self._files.get(path)
+            if cached and cached[:2] == stat:
+                new = cached[2] - seen
+                seen |= new
+                yield from new
+            else:
+                changed.append((path, stat))
+
+        if not changed:
+            return
+
+        log.debug('Reading %d package lists', len(changed))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(read_package_list, path): (path, stat) for path, stat in changed}
+            for future in as_completed(futures):
+                path, stat = futures[future]
+                try:
+                    names = future.result()
+                except (FileNotFoundError, UnicodeDecodeError) as e:
+                    log.warning('Could not read package list %s', path, exc_info=e)
+                    continue
+
+                self._files[path] = (*stat, names)
+                new = names - seen
+                seen |= new
+                yield from new
@@ -1,7 +1,20 @@
 """
 Different mirror picker implementations
+
+Every next takes an optional set of mirrors to exclude, for example the ones
+that keep failing. Excluded mirrors are only picked when nothing else can be
 """
-from random import randrange
+from heapq import heapify, heapreplace
+from random import random, randrange
+
+
+def _allowed(mirrors, exclude):
+    """
+    mirrors without the excluded ones, or all of them if that leaves none
+    """
+    if not exclude:
+        return mirrors
+    return [mirror for mirror in mirrors if mirror not in exclude] or mirrors
 
 
 class SinglePicker:
@@ -11,8 +24,8 @@ class SinglePicker:
     def __init__(self, mirrors, arg=None):
         self._mirrors = mirrors
 
-    def next(self, size=0):
-        return self._mirrors[0]
+    def next(self, size=0, exclude=()):
+        return _allowed(self._mirrors, exclude)[0]
 
 
 class RandomPicker:
@@ -22,8 +35,9 @@ class RandomPicker:
     def __init__(self, mirrors, arg=None):
         self._mirrors = mirrors
 
-    def next(self, size=0):
-        return self._mirrors[randrange(0, len(self._mirrors))]
+    def next(self, size=0, exclude=()):
+        mirrors = _allowed(self._mirrors, exclude)
+        return mirrors[randrange(0, len(mirrors))]
 
     def get_mirrors(self):
         return self._mirrors
@@ -42,11 +56,19 @@ class CounterPicker:
         self.current_item = 0
         self._mirrors = mirrors
 
-    def next(self, size=0):
+    def next(self, size=0, exclude=()):
 
         if self.uses >= self.max:
             self.current_item += 1
             self.uses = 0
+
+        # Move on from excluded mirrors, after a full round the first one is used anyway
+        if exclude:
+            for _ in range(len(self._mirrors)):
+                if self._mirrors[self.current_item % len(self._mirrors)] not in exclude:
+                    break
+                self.current_item += 1
+                self.uses = 0
         self.uses += 1
 
         return self._mirrors[self.current_item % len(self._mirrors)]
@@ -57,19 +79,22 @@ class LeastUsedPicker:
     The mirror that has been used the least taking package size into consideration
     """
     def __init__(self, mirrors, arg=None):
-        self._mirrors = [[mirror, 0] for mirror in mirrors]
-
-    def next(self, size=0):
-        smallest = -1
+        # [bytes used, position in the list, mirror], the position breaks ties
+        # in favour of mirrors earlier in the list
+        self._heap = [[0, num, mirror] for num, mirror in enumerate(mirrors)]
 
-        for num, (mirror, size_c) in enumerate(self._mirrors):
-            if smallest == -1:
-                smallest = 0
-            elif size_c < self._mirrors[smallest][1]:
-                smallest = num
+    def next(self, size=0, exclude=()):
+        if exclude:
+            allowed = [entry for entry in self._heap if entry[2] not in exclude]
+            if allowed:
+                entry = min(allowed)
+                entry[0] += size
+                heapify(self._heap)
+                return entry[2]
 
-        self._mirrors[smallest][1] += size
-        return self._mirrors[smallest][0]
+        used, num, mirror = self._heap[0]
+        heapreplace(self._heap, [used + size, num, mirror])
+        return mirror
 
 
 class CapPicker:
@@ -78,16 +103,173 @@ class CapPicker:
     """
     def __init__(self, mirrors, arg=0):
         self.cap = arg
-        self._mirrors = [[mirror, 0] for mirror in mirrors]
+        self._names = list(mirrors)
+        # Mirrors before this one were removed
+        self._first = 0
 
-    def next(self, size=0):
+        # A tree in a heap layout (children of i are 2i and 2i + 1) holding the
+        # most bytes left under the cap of any mirror below each node. Finding
+        # the first mirror with room for a package is a walk from the root
+        self._leaves = 1
+        while self._leaves < len(self._names):
+            self._leaves *= 2
+        self._tree = [float("-inf")] * (2 * self._leaves)
+        for num in range(len(self._names)):
+            self._tree[self._leaves + num] = self.cap
+        for node in reversed(range(1, self._leaves)):
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def _set(self, num, room):
+        node = self._leaves + num
+        self._tree[node] = room
+        node //= 2
+        while node:
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def _swap(self, first, second):
+        first_room, second_room = self._tree[self._leaves + first], self._tree[self._leaves + second]
+        self._names[first], self._names[second] = self._names[second], self._names[first]
+        self._set(first, second_room)
+        self._set(second, first_room)
+
+    def _find(self, size, exclude):
+        """
+        The leaf of the first mirror that is not excluded and has more room than size
+        """
+        # Left to right, skipping every subtree without enough room
+        stack = [1]
+        while stack:
+            node = stack.pop()
+            if self._tree[node] <= size:
+                continue
+            if node >= self._leaves:
+                if self._names[node - self._leaves] not in exclude:
+                    return node
+                continue
+            stack.append(2 * node + 1)
+            stack.append(2 * node)
+        return None
+
+    def next(self, size=0, exclude=()):
         if size > self.cap:
-            return self._mirrors.pop(0)[0]
+            if self._first >= len(self._names):
+                raise IndexError("pop from empty list")
+            # The first mirror that is not excluded takes the place of the first one
+            if exclude:
+                for num in range(self._first, len(self._names)):
+                    if self._names[num] not in exclude:
+                        if num != self._first:
+                            self._swap(self._first, num)
+                        break
+            mirror = self._names[self._first]
+            self._set(self._first, float("-inf"))
+            self._first += 1
+            return mirror
 
-        for num, (mirror, quota) in enumerate(self._mirrors):
-            if quota + size < self.cap:
-                self._mirrors[num][1] += size
-                return mirror
+        # Needs strictly more room than size
+        if self._tree[1] <= size:
+            return None
+
+        node = self._find(size, exclude) if exclude else None
+        if node is None:
+            node = 1
+            while node < self._leaves:
+                node = 2 * node if self._tree[2 * node] > size else 2 * node + 1
+        num = node - self._leaves
+        self._set(num, self._tree[node] - size)
+        return self._names[num]
 
     def get_mirrors(self):
-        return [mirror[0] for mirror in self._mirrors]
+        return self._names[self._first:]
+
+
+class ThroughputPicker:
+    """
+    Learns how fast each mirror is from finished downloads and gives work to
+    the mirror expected to finish it first. Every `arg` share of picks (5% by
+    default) of packages no bigger than `explore_size` goes to a random mirror
+    instead so slow or new mirrors are measured again
+    """
+    def __init__(self, mirrors, arg=0.05, alpha=0.3, explore_size=10**6, initial_throughput=10**6,
+                 initial_latency=0.1):
+        self.explore = arg
+        self.alpha = alpha
+        self.explore_size = explore_size
+        self._mirrors = list(mirrors)
+        # Estimates of a mirror's total bytes per second and its latency in seconds, None until measured
+        self._throughput = {mirror: None for mirror in self._mirrors}
+        self._latency = {mirror: None for mirror in self._mirrors}
+        # Bytes and downloads handed to each mirror that are not finished yet
+        self._queued = {mirror: 0 for mirror in self._mirrors}
+        self._active = {mirror: 0 for mirror in self._mirrors}
+        self.initial_throughput = initial_throughput
+        self.initial_latency = initial_latency
+
+    def _defaults(self):
+        # Unmeasured mirrors are assumed to be as good as the best measured
+        # one so they get tried early
+        throughput = max((t for t in self._throughput.values() if t), default=self.initial_throughput)
+        latency = min((l for l in self._latency.values() if l is not None), default=self.initial_latency)
+        return throughput, latency
+
+    def expected_completion(self, mirror, size=0, defaults=None):
+        """
+        Seconds until a download of size bytes would be done on mirror
+        """
+        default_throughput, default_latency = defaults or self._defaults()
+        throughput = self._throughput[mirror] or default_throughput
+        latency = self._latency[mirror]
+        if latency is None:
+            latency = default_latency
+        return latency + (self._queued[mirror] + size) / throughput
+
+    def next(self, size=0, exclude=()):
+        mirrors = _allowed(self._mirrors, exclude)
+        if size <= self.explore_size and random() < self.explore:
+            mirror = mirrors[randrange(0, len(mirrors))]
+        else:
+            # Until a mirror is measured it only gets one download at a time
+            candidates = [m for m in mirrors if self._throughput[m] or not self._active[m]]
+            defaults = self._defaults()
+            mirror = min(candidates or mirrors, key=lambda m: self.expected_completion(m, size, defaults))
+        self._queued[mirror] += size
+        self._active[mirror] += 1
+        return mirror
+
+    def _ewma(self, old, new):
+        return new if old is None else old + self.alpha * (new - old)
+
+    def _finished(self, mirror, size):
+        active = self._active[mirror]
+        self._queued[mirror] = max(0, self._queued[mirror] - size)
+        self._active[mirror] = max(0, active - 1)
+        return max(1, active)
+
+    def report(self, mirror, size, seconds, latency=0.0, transferred=None):
+        """
+        A download of size bytes handed out by next finished in seconds, of
+        which latency was spent waiting for the mirror to respond. transferred
+        is how much the mirror actually sent if that was less (resumed downloads)
+        """
+        if mirror not in self._queued:
+            return
+        if transferred is None:
+            transferred = size
+
+        # The mirror's bandwidth was shared with the other downloads running on it
+        active = self._finished(mirror, size)
+        self._latency[mirror] = self._ewma(self._latency[mirror], latency)
+        if transferred and seconds > latency:
+            throughput = transferred / (seconds - latency) * active
+            self._throughput[mirror] = self._ewma(self._throughput[mirror], throughput)
+
+    def report_failure(self, mirror, size):
+        """
+        A download handed out by next did not finish
+        """
+        if mirror in self._queued:
+            self._finished(mirror, size)
+
+    def get_mirrors(self):
+        return self._mirrors
@@ -0,0 +1,108 @@
+"""
+Bandwidth limits for downloads, in total and per mirror
+"""
+from threading import Lock
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """
+    Lets `rate` bytes through per second on average with bursts of up to
+    `burst` bytes. Bytes are reserved in the order they are asked for so
+    downloads share the rate fairly, and whatever an idle download does not
+    use goes to the others. A rate of None is no limit.
+
+    Thread safe, reserve never blocks so it can also be used from asyncio
+    """
+    def __init__(self, rate=None, burst=None, clock=monotonic):
+        self._lock = Lock()
+        self._clock = clock
+        # Starts with a full burst
+        self._tokens = None
+        self._updated = clock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """
+        Change the limit, also while downloads are running
+        """
+        with self._lock:
+            self.rate = rate
+            self.burst = burst or rate or 0
+            self._tokens = self.burst if self._tokens is None else min(self._tokens, self.burst)
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """
+        Take amount bytes. Returns how many seconds to wait before using them
+        """
+        with self._lock:
+            now = self._clock()
+            if not self.rate:
+                self._updated = now
+                return 0.0
+            self._refill(now)
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def consume(self, amount):
+        """
+        Take amount bytes, sleeping until they may be used
+        """
+        wait = self.reserve(amount)
+        if wait:
+            sleep(wait)
+
+
+class RateLimiter:
+    """
+    A bucket for all downloads together and one for each mirror
+    """
+    def __init__(self, rate=None, mirror_rate=None, clock=monotonic):
+        self._clock = clock
+        self._lock = Lock()
+        self._mirrors = {}
+        self.mirror_rate = mirror_rate
+        self.total = TokenBucket(rate, clock=clock)
+
+    def set_rates(self, rate=None, mirror_rate=None):
+        """
+        Change the limits, also while downloads are running
+        """
+        self.total.set_rate(rate)
+        with self._lock:
+            self.mirror_rate = mirror_rate
+            for bucket in self._mirrors.values():
+                bucket.set_rate(mirror_rate)
+
+    def limited(self):
+        return bool(self.total.rate or self.mirror_rate)
+
+    def _mirror_bucket(self, mirror):
+        with self._lock:
+            if mirror not in self._mirrors:
+                self._mirrors[mirror] = TokenBucket(self.mirror_rate, clock=self._clock)
+            return self._mirrors[mirror]
+
+    def reserve(self, mirror, amount):
+        """
+        Take amount bytes from mirror. Returns how many seconds to wait before using them
+        """
+        return max(self.total.reserve(amount), self._mirror_bucket(mirror).reserve(amount))
+
+    def throttle(self, mirror):
+        """
+        A function for download.copy_response that sleeps to keep downloads
+        from mirror within the limits. None when there are no limits
+        """
+        if not self.limited():
+            return None
+
+        def throttle(amount):
+            wait = self.reserve(mirror, amount)
+            if wait:
+                sleep(wait)
+        return throttle
@@ -0,0 +1,59 @@
+"""
+Resolving package names through provides, replaces and dependencies
+"""
+from typing import Iterable, Optional, Set, Tuple
+
+from fastpac.database import package_relations
+from fastpac.search import PackageIndex
+
+
+class Resolver:
+    """
+    Turns names from package lists into the packages the repos actually have.
+
+    A name is resolved to the package with that name, otherwise to a package
+    that replaces it (it was renamed) and otherwise to a package that provides
+    it. When several packages fit the one from the earliest repo is used
+    """
+    def __init__(self, index: PackageIndex):
+        self._index = index
+        self._depends = {}
+        self._provides = {}
+        self._replaces = {}
+
+        for name, (_, package) in index.items():
+            depends, provides, replaces = package_relations(package)
+            self._depends[name] = depends
+            for provided in provides:
+                self._provides.setdefault(provided, name)
+            for replaced in replaces:
+                self._replaces.setdefault(replaced, name)
+
+    def resolve(self, name: str) -> Optional[str]:
+        if name in self._index:
+            return name
+        if name in self._replaces:
+            return self._replaces[name]
+        return self._provides.get(name)
+
+    def closure(self, names: Iterable[str], depends: bool = True) -> Tuple[Set[str], Set[str]]:
+        """
+        Resolve names and, if `depends`, everything they need to be installed.
+
+        Returns the packages found and the names that could not be resolved
+        """
+        found = set()
+        missing = set()
+        # names can be a generator, each one is resolved as it arrives
+        for name in names:
+            pending = [name]
+            while pending:
+                name = pending.pop()
+                package = self.resolve(name)
+                if package is None:
+                    missing.add(name)
+                elif package not in found:
+                    found.add(package)
+                    if depends:
+                        pending.extend(self._depends[package])
+        return found, missing
@@ -0,0 +1,59 @@
+"""
+Ordering the download queue by package size
+"""
+from heapq import heapify, heapreplace
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def order_packages(package_infos, strategy="longest"):
+    """
+    Order packages for the download queue.
+
+    "longest" puts the biggest packages first. Workers take the next package
+    as soon as they are free, so this is longest processing time first
+    scheduling and a big package never ends up alone at the tail of the run.
+    "name" is alphabetical
+    """
+    if strategy == "longest":
+        return sorted(package_infos, key=lambda info: (-int(info.size), info.name))
+    if strategy == "name":
+        return sorted(package_infos, key=lambda info: info.name)
+    raise ValueError(f'Unknown schedule {strategy!r}')
+
+
+def predict_makespan(sizes, workers, bandwidth):
+    """
+    Seconds until the last download finishes when `workers` each take the next
+    size in order as soon as they are free, at bandwidth bytes per second each
+    """
+    loads = [0] * max(1, workers)
+    heapify(loads)
+    for size in sizes:
+        heapreplace(loads, loads[0] + size)
+    return max(loads) / bandwidth
+
+
+def report_makespan(results, workers, elapsed):
+    """
+    Log how long the downloads took against what the schedule predicted
+
+    Arguments:
+        results: the Transfers of every download in the order they were queued
+        workers: downloads running at once
+        elapsed: seconds the downloads actually took
+    """
+    transfers = [transfer for result in results for transfer in result]
+    total = sum(transfer.size for transfer in transfers)
+    busy = sum(transfer.seconds for transfer in transfers)
+    if not total or not busy:
+        log.info('Nothing was downloaded')
+        return
+
+    # How fast a single worker went on average
+    bandwidth = total / busy
+    sizes = [sum(transfer.size for transfer in result) for result in results]
+    log.info('Downloaded %d packages (%.1f MB) in %.1fs, predicted %.1fs, ideal %.1fs',
+             len(results), total / 10**6, elapsed, predict_makespan(sizes, workers, bandwidth),
+             total / (bandwidth * workers))
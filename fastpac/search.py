@@ -1,18 +1,27 @@
 """
 All functionality relating to searching package databases
 """
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
 import logging
+from time import perf_counter
 from tarfile import TarError, open as tar_open
-from typing import Iterable, Optional, NamedTuple
+from types import MappingProxyType
+from typing import Dict, Iterable, Optional, NamedTuple
 
-from requests import get, RequestException
+from requests import RequestException
 
-from fastpac.database import Repo
-from fastpac.util import aslist
+from fastpac.cache import CachedRepo, RepoCache
+from fastpac.database import Database, Repo
+from fastpac import metrics
+from fastpac.session import get
 
 log = logging.getLogger(__name__)
 
+repo_fetch_seconds = metrics.histogram('fastpac_repo_fetch_seconds', 'Time to fetch a repo database', ('repo',))
+repo_parse_seconds = metrics.histogram('fastpac_repo_parse_seconds', 'Time to parse a repo database')
+lookup_seconds = metrics.histogram('fastpac_lookup_seconds', 'Time to look up all wanted packages')
+
 
 def gen_dbs(name, url):
     """
@@ -23,16 +32,53 @@ def gen_dbs(name, url):
 
 
 def download_tar(url):
+    """
+    The repo database at url as a tar and as a Database, the compressed bytes
+    are kept for the fields the records leave out
+    """
     # Why this small function?
     # Unit testing and future centralized downloader
     # TODO: Centralized downloading
     try:
-        return tar_open(fileobj=BytesIO(get(url).content))
+        content = get(url).content
+        return tar_open(fileobj=BytesIO(content)), Database(data=content)
     except (TarError, RequestException) as e:
         log.info('Got error while downloading %r', url, exc_info=e)
 
 
-def fetch_repo(repo_name, mirrors):
+def parse_repo(tar, database=None) -> Repo:
+    with repo_parse_seconds.time():
+        return Repo(tar, database)
+
+
+def download_repo_cached(url, cache: RepoCache) -> Optional[Repo]:
+    """
+    Download and parse a repo database unless the cached copy is still current
+    """
+    cached = cache.load(url)
+    try:
+        response = get(url, headers=cache.validators(cached))
+        if response.status_code == 304 and cached:
+            log.info('%r has not changed, using cached copy', url)
+            return cached.db
+        response.raise_for_status()
+        # The records read the fields they leave out from the cached database
+        database = cache.store_database(url, response.content)
+        db = parse_repo(tar_open(fileobj=BytesIO(response.content)), database)
+    except (TarError, RequestException) as e:
+        log.info('Got error while downloading %r', url, exc_info=e)
+        return None
+
+    cache.store(CachedRepo(
+        url=url,
+        etag=response.headers.get("ETag", ""),
+        last_modified=response.headers.get("Last-Modified", ""),
+        db=db
+    ))
+    return db
+
+
+def fetch_repo(repo_name, mirrors, cache: Optional[RepoCache] = None):
     """
     Download a repository database
     """
@@ -40,18 +86,74 @@ def fetch_repo(repo_name, mirrors):
         db_directory = "/".join(e.strip("/") for e in [mirror, repo_name, "os/x86_64"]) + "/"
         for repo_url in gen_dbs(repo_name, db_directory):
             log.info("Downloading %r", repo_url)
+            if cache is not None:
+                db = download_repo_cached(repo_url, cache)
+                if db:
+                    return RepoMeta(name=repo_name, mirror=mirror, db=db)
+                continue
+
             repo = download_tar(repo_url)
             if repo:
-                return RepoMeta(name=repo_name, mirror=mirror, db=Repo(repo))
+                return RepoMeta(name=repo_name, mirror=mirror, db=parse_repo(*repo))
 
 
-@aslist
-def download_repos(repos, mirrors):
+def race_repo(repo_name, mirrors, race, cache: Optional[RepoCache] = None):
     """
-    Download multiple repositories
+    Fetch a repository database from the first `race` mirrors at the same time
+    and keep the first good answer. Falls back to the rest of the mirrors in order
+    if none of them have it
     """
-    for repo in repos:
-        yield fetch_repo(repo, mirrors)
+    racers = mirrors[:race]
+    pool = ThreadPoolExecutor(max_workers=len(racers) or 1)
+    try:
+        futures = [pool.submit(fetch_repo, repo_name, [mirror], cache=cache) for mirror in racers]
+        for future in as_completed(futures):
+            if future.result():
+                return future.result()
+    finally:
+        # Losers are left to finish in the background
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return fetch_repo(repo_name, mirrors[race:], cache=cache)
+
+
+def timed_fetch_repo(repo_name, mirrors, race=0, cache: Optional[RepoCache] = None):
+    start = perf_counter()
+    if race > 1:
+        repo = race_repo(repo_name, mirrors, race, cache=cache)
+    else:
+        repo = fetch_repo(repo_name, mirrors, cache=cache)
+
+    repo_fetch_seconds.observe(perf_counter() - start, repo=repo_name)
+    if repo:
+        log.info("Fetched %r from %s in %.2fs", repo_name, repo.mirror, perf_counter() - start)
+    else:
+        log.warning("Could not fetch %r from any mirror after %.2fs", repo_name, perf_counter() - start)
+    return repo
+
+
+def download_repos(repos, mirrors, cache_dir=None, workers=4, race=0):
+    """
+    Download multiple repositories at the same time. The result is in the same
+    order as `repos`
+
+    Arguments:
+        repos: names of the repos
+        mirrors: mirrors to try in order
+        cache_dir: keep parsed databases here and only download them again when they changed
+        workers: number of repos downloaded at once
+        race: download each repo from this many mirrors at once and use the first to finish
+    """
+    # Every repo walks the mirrors on its own
+    mirrors = list(mirrors)
+    cache = RepoCache(cache_dir) if cache_dir else None
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(timed_fetch_repo, repo, mirrors, race=race, cache=cache) for repo in repos]
+        result = [future.result() for future in futures]
+    log.info("Fetched %d repos in %.2fs", len(result), perf_counter() - start)
+    return result
 
 
 class RepoMeta(NamedTuple):
@@ -83,14 +185,66 @@ def find_package(name: str, repos: Iterable[RepoMeta], limit: int = -1) -> Optio
             break
 
         if name in repo.db:
-            info = PackageInfo(
-                mirror=repo.mirror,
-                repo=repo.name,
-                name=name,
-                filename=repo.db[name]["filename"],
-                size=repo.db[name]["csize"],
-                sha256=repo.db[name]["sha256sum"] if "sha256sum" in repo.db[name] else ""
-            )
-            return info
+            return make_package_info(repo, name, repo.db[name])
         limit -= 1
     return None
+
+
+def make_package_info(repo: RepoMeta, name: str, package) -> PackageInfo:
+    return PackageInfo(
+        mirror=repo.mirror,
+        repo=repo.name,
+        name=name,
+        filename=package["filename"],
+        size=int(package["csize"]),
+        sha256=package["sha256sum"] if "sha256sum" in package else ""
+    )
+
+
+class PackageIndex:
+    """
+    Every package name across all repos mapped to its repo and record. When
+    several repos have a package the earliest repo wins, the same as find_package.
+
+    The index is never changed after it is built so any thread can use it
+    without a lock
+    """
+    def __init__(self, repos: Iterable[RepoMeta]):
+        index = {}
+        for repo in repos:
+            # A repo that could not be downloaded
+            if repo is None:
+                continue
+
+            for name in repo.db:
+                if name not in index:
+                    index[name] = (repo, repo.db[name])
+        self._index = MappingProxyType(index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def items(self):
+        """
+        Names with their repo and record, earliest repo first
+        """
+        return self._index.items()
+
+    def find(self, name: str) -> Optional[PackageInfo]:
+        """
+        Find a package filename and repo
+        """
+        entry = self._index.get(name)
+        if entry is None:
+            return None
+        return make_package_info(entry[0], name, entry[1])
+
+    def find_all(self, names: Iterable[str]) -> Dict[str, Optional[PackageInfo]]:
+        """
+        Find many packages at once. Names that are not in any repo map to None
+        """
+        with lookup_seconds.time():
+            return {name: self.find(name) for name in names}
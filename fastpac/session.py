@@ -0,0 +1,45 @@
+"""
+Shared HTTP session so connections to mirrors are kept alive and reused
+"""
+from threading import Lock
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+# Connection pools are kept for this many mirrors at once
+MAX_MIRRORS = 64
+
+_session = None
+_session_lock = Lock()
+_pool_size = 10
+
+
+def configure(pool_size):
+    """
+    Set how many connections are kept open to each mirror. Should be the number
+    of threads downloading at once
+    """
+    global _session, _pool_size
+    with _session_lock:
+        _pool_size = pool_size
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_session() -> Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=MAX_MIRRORS, pool_maxsize=_pool_size)
+            _session = Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def get(url, **kwargs):
+    """
+    requests.get over the shared session
+    """
+    return get_session().get(url, **kwargs)
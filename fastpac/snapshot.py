@@ -0,0 +1,71 @@
+"""
+What the repos looked like after the last run, so the next run can only
+look at what changed
+"""
+import json
+import logging
+from pathlib import Path
+
+from fastpac.util import atomic_write
+
+log = logging.getLogger(__name__)
+
+
+class RepoSnapshot:
+    """
+    The filename of every package in every repo, and the packages that were
+    wanted, as of the last run
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        # repo name -> package name -> filename
+        self.repos = {}
+        self.packages = set()
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.repos = data["repos"]
+            self.packages = set(data["packages"])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            log.warning('Ignoring unreadable snapshot %s', self.path, exc_info=e)
+
+    def changed(self, repos, package_names):
+        """
+        The names in package_names that are new since the last run or whose
+        filename (so version) changed in any repo
+        """
+        changed = set(package_names) - self.packages
+        for repo in repos:
+            if repo is None:
+                continue
+
+            previous = self.repos.get(repo.name)
+            if previous is None:
+                # Never seen this repo, everything in it is new
+                changed.update(name for name in package_names if name in repo.db)
+                continue
+
+            for name in package_names:
+                if name in repo.db and previous.get(name) != repo.db[name]["filename"]:
+                    changed.add(name)
+        return changed
+
+    def update(self, repos, package_names, failed=()):
+        """
+        Remember the repos and wanted packages. Packages in failed are left out
+        so the next run tries them again
+        """
+        failed = set(failed)
+        for repo in repos:
+            if repo is None:
+                continue
+            self.repos[repo.name] = {name: repo.db[name]["filename"] for name in repo.db if name not in failed}
+        self.packages = set(package_names) - failed
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.path) as f:
+            json.dump({"repos": self.repos, "packages": sorted(self.packages)}, f)
@@ -0,0 +1,117 @@
+"""
+Content addressed store of packages keyed by their sha256, so the same
+package is only downloaded once for every download_dir and architecture
+"""
+import fcntl
+import logging
+import os
+from pathlib import Path
+from shutil import copyfile
+from threading import Lock, get_ident
+
+log = logging.getLogger(__name__)
+
+# From linux/fs.h, share the blocks of one file with another on btrfs and xfs
+FICLONE = 0x40049409
+
+
+def reflink(source, dest):
+    with open(source, mode='rb') as src, open(dest, mode='wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def place(source, dest):
+    """
+    Make dest have the contents of source as cheaply as possible: a hardlink,
+    otherwise a reflink, otherwise a copy. dest is replaced at once
+    """
+    # Several threads can place the same file
+    partial = dest.with_name(f"{dest.name}.{get_ident()}.link")
+    try:
+        os.remove(partial)
+    except FileNotFoundError:
+        pass
+
+    try:
+        os.link(source, partial)
+    except OSError:
+        # Different filesystems
+        try:
+            reflink(source, partial)
+        except OSError:
+            copyfile(source, partial)
+    os.replace(partial, dest)
+
+
+class ContentStore:
+    """
+    Packages stored under their sha256. Only files whose hash has been checked
+    are added. Copies are hardlinks where possible, so a copy found corrupt
+    means the entry is too and it is evicted
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = Lock()
+        # Downloads avoided since the last take_stats
+        self.hits = 0
+        self.saved_bytes = 0
+
+    def path_for(self, sha256):
+        return self.path / sha256[:2] / sha256
+
+    def fetch(self, sha256, dest) -> bool:
+        """
+        Put the package with this sha256 at dest if the store has it
+        """
+        source = self.path_for(sha256)
+        try:
+            size = source.stat().st_size
+            place(source, dest)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            log.warning('Could not take %s from the store', dest.name, exc_info=e)
+            return False
+
+        log.info('%r taken from the store', dest.name)
+        with self._lock:
+            self.hits += 1
+            self.saved_bytes += size
+        return True
+
+    def add(self, sha256, path):
+        """
+        Add a package whose hash has been checked
+        """
+        stored = self.path_for(sha256)
+        if stored.is_file():
+            return
+
+        try:
+            stored.parent.mkdir(parents=True, exist_ok=True)
+            place(path, stored)
+        except OSError as e:
+            log.warning('Could not add %s to the store', path.name, exc_info=e)
+
+    def evict(self, sha256):
+        """
+        Drop the package with this sha256, for when a copy of it turned out to
+        be corrupt. A hardlinked copy shares its contents with the store
+        """
+        try:
+            os.remove(self.path_for(sha256))
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            log.warning('Could not remove %s from the store', sha256, exc_info=e)
+            return
+        log.warning('Removed %s from the store', sha256)
+
+    def take_stats(self):
+        """
+        Downloads avoided and their bytes since the last call
+        """
+        with self._lock:
+            stats = (self.hits, self.saved_bytes)
+            self.hits = self.saved_bytes = 0
+        return stats
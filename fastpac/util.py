@@ -3,10 +3,31 @@ Utility functions
 """
 
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+from pathlib import Path
 import sys
 import traceback
 
 
+@contextmanager
+def atomic_write(path, mode="w"):
+    """
+    Open a file next to path for the with block to write, then move it in
+    place so a crash or a reader never sees half of it. Nothing is replaced
+    if the block raises
+    """
+    path = Path(path)
+    partial = path.with_name(path.name + ".tmp")
+    try:
+        with open(partial, mode=mode) as f:
+            yield f
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    os.replace(partial, path)
+
+
 def aslist(function):
     """
     A function that returns a generator with return a lists if this decorator is applied
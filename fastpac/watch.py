@@ -0,0 +1,72 @@
+"""
+Watching package_list_dir for new and changed package lists. Uses inotify
+when inotify_simple is installed (pip install fastpac[inotify]), otherwise
+looks at the modification times every few seconds
+"""
+import logging
+from pathlib import Path
+from time import monotonic, sleep
+
+try:
+    import inotify_simple
+    have_inotify = True
+except ImportError:
+    have_inotify = False
+
+log = logging.getLogger(__name__)
+
+
+class ListWatcher:
+    """
+    Tells which files in a directory were added or written to since it was
+    last asked
+    """
+    def __init__(self, path, poll_interval=5, use_inotify=True):
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self._inotify = None
+        self._mtimes = self._scan()
+
+        if use_inotify and have_inotify:
+            self._inotify = inotify_simple.INotify()
+            # Only once a file is completely written or moved in
+            flags = inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO
+            self._inotify.add_watch(str(self.path), flags)
+        else:
+            log.info('Polling %s for changes every %ss', self.path, poll_interval)
+
+    def _scan(self):
+        mtimes = {}
+        for child in self.path.iterdir():
+            try:
+                mtimes[child] = child.stat().st_mtime_ns
+            except FileNotFoundError:
+                pass
+        return mtimes
+
+    def _poll(self):
+        mtimes = self._scan()
+        changed = [path for path, mtime in mtimes.items() if self._mtimes.get(path) != mtime]
+        self._mtimes = mtimes
+        return changed
+
+    def changes(self, timeout):
+        """
+        Wait up to timeout seconds for files to be added or changed and return
+        their paths. Returns as soon as there is one, an empty list if there was none
+        """
+        if self._inotify:
+            events = self._inotify.read(timeout=int(timeout * 1000))
+            return sorted({self.path / event.name for event in events if event.name})
+
+        deadline = monotonic() + timeout
+        while True:
+            changed = self._poll()
+            remaining = deadline - monotonic()
+            if changed or remaining <= 0:
+                return sorted(changed)
+            sleep(min(self.poll_interval, remaining))
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
@@ -12,6 +12,12 @@ setup(
         'dev': [
             'pytest',
         ],
+        'async': [
+            'aiohttp',
+        ],
+        'inotify': [
+            'inotify_simple',
+        ],
     },
     license='GPL3'
 )
@@ -0,0 +1,90 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    # Clients hanging up early is expected, don't print tracebacks for it
+    def handle_error(self, request, client_address):
+        pass
+
+
+class LocalServer:
+    """
+    A local HTTP stand-in for a mirror. Serves the bytes in `files` and
+    records the headers of every request it gets
+    """
+    def __init__(self):
+        self.files = {}
+        self.etags = {}
+        self.last_modified = {}
+        self.requests = []
+        self.clients = []
+        # Paths served whole even when a range is asked for
+        self.ignore_range = set()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                server.clients.append(self.client_address)
+                if self.path not in server.files:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                etag = server.etags.get(self.path)
+                last_modified = server.last_modified.get(self.path)
+                if (etag and self.headers.get("If-None-Match") == etag) or \
+                        (last_modified and self.headers.get("If-Modified-Since") == last_modified):
+                    self.send_response(304)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                body = server.files[self.path]
+                status = 200
+                content_range = None
+                if self.headers.get("Range") and self.path not in server.ignore_range:
+                    start, _, end = self.headers["Range"].partition("=")[2].partition("-")
+                    start = int(start)
+                    end = int(end) if end else len(body) - 1
+                    content_range = f"bytes {start}-{end}/{len(body)}"
+                    body = body[start:end + 1]
+                    status = 206
+
+                self.send_response(status)
+                if content_range:
+                    self.send_header("Content-Range", content_range)
+                if etag:
+                    self.send_header("ETag", etag)
+                if last_modified:
+                    self.send_header("Last-Modified", last_modified)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = QuietHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def local_server():
+    server = LocalServer()
+    yield server
+    server.close()
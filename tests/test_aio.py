@@ -0,0 +1,81 @@
+from hashlib import sha256
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from fastpac.aio import AsyncDownloader
+from fastpac.ledger import VerificationLedger
+from fastpac.picker import CounterPicker
+from fastpac.search import PackageInfo
+
+
+def make_info(name, body, sha256sum=None):
+    return PackageInfo(mirror="", repo="core", name=name, filename=f"{name}.tar", size=len(body),
+                       sha256=sha256(body).hexdigest() if sha256sum is None else sha256sum)
+
+
+def test_aio_download(tmp_path, local_server):
+    bodies = {f"package{num}": f"package{num}".encode() * 1000 for num in range(20)}
+    for name, body in bodies.items():
+        local_server.files[f"/a/core/os/x86_64/{name}.tar"] = body
+
+    ledger = VerificationLedger(tmp_path / "ledger.json")
+    dest = tmp_path / "pkg"
+    dest.mkdir()
+    downloader = AsyncDownloader(dest, CounterPicker([local_server.url + "/a/"]), ledger=ledger,
+                                 concurrency=5, mirror_concurrency=2)
+    downloader.run([make_info(name, body) for name, body in bodies.items()])
+
+    for name, body in bodies.items():
+        assert (dest / f"{name}.tar").read_bytes() == body
+        assert ledger.is_verified(dest / f"{name}.tar", sha256(body).hexdigest())
+
+
+def test_aio_failover(tmp_path, local_server):
+    body = b"contents" * 1000
+    # The first mirror has a corrupt copy, the second one is missing it
+    local_server.files["/a/core/os/x86_64/package.tar"] = b"corrupt"
+    local_server.files["/c/core/os/x86_64/package.tar"] = body
+
+    dest = tmp_path
+    picker = CounterPicker([local_server.url + "/a/", local_server.url + "/b/", local_server.url + "/c/"])
+    AsyncDownloader(dest, picker, backoff=0).run([make_info("package", body)])
+    assert (dest / "package.tar").read_bytes() == body
+
+
+def test_aio_existing(tmp_path, local_server):
+    body = b"contents"
+    (tmp_path / "package.tar").write_bytes(body)
+
+    # Already present and matching, nothing is requested
+    AsyncDownloader(tmp_path, CounterPicker([local_server.url + "/a/"])).run([make_info("package", body)])
+    assert local_server.requests == []
+
+
+def test_aio_resume(tmp_path, local_server):
+    body = b"contents" * 1000
+    local_server.files["/a/core/os/x86_64/package.tar"] = body
+    (tmp_path / "package.tar.part").write_bytes(body[:100])
+
+    AsyncDownloader(tmp_path, CounterPicker([local_server.url + "/a/"])).run([make_info("package", body)])
+    assert local_server.requests[-1][1]["Range"] == "bytes=100-"
+    assert (tmp_path / "package.tar").read_bytes() == body
+    assert not (tmp_path / "package.tar.part").exists()
+
+
+def test_aio_no_mirror(tmp_path, local_server):
+    body = b"contents" * 1000
+    local_server.files["/a/core/os/x86_64/package.tar"] = body
+
+    class OutOfMirrors:
+        # Like CapPicker when no mirror has room left, once
+        def __init__(self):
+            self.picks = 0
+
+        def next(self, size=0):
+            self.picks += 1
+            return None if self.picks == 1 else local_server.url + "/a/"
+
+    AsyncDownloader(tmp_path, OutOfMirrors(), backoff=0).run([make_info("package", body)])
+    assert (tmp_path / "package.tar").read_bytes() == body
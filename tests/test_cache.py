@@ -0,0 +1,66 @@
+import io
+import tarfile
+
+import pytest
+
+import fastpac.search as search
+from fastpac.cache import CachedRepo, RepoCache
+from fastpac.database import Repo
+
+
+def create_db(names):
+    tar = tarfile.TarFile(fileobj=io.BytesIO(), mode='w')
+    for name in names:
+        contents = f"%NAME%\n{name}\n%FILENAME%\n{name}-1.0.tar\n%CSIZE%\n1\n".encode()
+        info = tarfile.TarInfo(name=f"{name}/desc")
+        info.size = len(contents)
+        tar.addfile(info, fileobj=io.BytesIO(contents))
+    tar.close()
+    return tar.fileobj.getvalue()
+
+
+def test_cache_store_load(tmp_path):
+    cache = RepoCache(tmp_path)
+    assert cache.load("https://a/core.db") is None
+
+    entry = CachedRepo(url="https://a/core.db", etag='"1"', last_modified="", db=Repo({"a": {"filename": "a.tar"}}))
+    cache.store(entry)
+
+    assert RepoCache(tmp_path).load("https://a/core.db") == entry
+    assert cache.load("https://b/core.db") is None
+    assert cache.validators(entry) == {"If-None-Match": '"1"'}
+
+
+def test_cache_revalidate_etag(tmp_path, local_server):
+    local_server.files["/core/os/x86_64/core.db.tar.gz"] = create_db(["package"])
+    local_server.etags["/core/os/x86_64/core.db.tar.gz"] = '"v1"'
+
+    first = search.download_repos(["core"], [local_server.url], cache_dir=tmp_path)
+    assert list(first[0].db) == ["package"]
+    assert "If-None-Match" not in local_server.requests[-1][1]
+
+    # Unchanged: one conditional request and the cached copy is used
+    second = search.download_repos(["core"], [local_server.url], cache_dir=tmp_path)
+    assert local_server.requests[-1][1]["If-None-Match"] == '"v1"'
+    assert second[0].db == first[0].db
+    # The cached records read their desc from the database kept next to them
+    assert second[0].db["package"].desc().startswith(b"%NAME%\npackage\n")
+
+    # Changed: downloaded and parsed again
+    local_server.files["/core/os/x86_64/core.db.tar.gz"] = create_db(["package", "package2"])
+    local_server.etags["/core/os/x86_64/core.db.tar.gz"] = '"v2"'
+    third = search.download_repos(["core"], [local_server.url], cache_dir=tmp_path)
+    assert list(third[0].db) == ["package", "package2"]
+    assert RepoCache(tmp_path).load(local_server.url + "/core/os/x86_64/core.db.tar.gz").etag == '"v2"'
+
+
+def test_cache_revalidate_last_modified(tmp_path, local_server):
+    path = "/core/os/x86_64/core.db.tar.gz"
+    local_server.files[path] = create_db(["package"])
+    local_server.last_modified[path] = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+    search.download_repos(["core"], [local_server.url], cache_dir=tmp_path)
+    repos = search.download_repos(["core"], [local_server.url], cache_dir=tmp_path)
+
+    assert local_server.requests[-1][1]["If-Modified-Since"] == "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert list(repos[0].db) == ["package"]
@@ -94,3 +94,72 @@ def test_database_package_parse():
     name2
     name3
     """) == {"package": {"multi": "name1\nname2\nname3"}}
+
+
+def test_database_repo_tar_skips_other_members():
+    """
+    Directories and non desc files are ignored and read members are not kept around
+    """
+    tar = tarfile.TarFile(fileobj=io.BytesIO(), mode='w')
+    for name in ["test1", "test2"]:
+        directory = tarfile.TarInfo(name=name)
+        directory.type = tarfile.DIRTYPE
+        tar.addfile(directory)
+
+        for file_name, contents in [("desc", f"%NAME%\n{name}\n"), ("files", "%FILES%\nusr/\n")]:
+            info = tarfile.TarInfo(name=f"{name}/{file_name}")
+            info.size = len(contents)
+            tar.addfile(info, fileobj=io.BytesIO(contents.encode()))
+    tar.close()
+
+    tar = tarfile.TarFile(fileobj=io.BytesIO(tar.fileobj.getvalue()))
+    repo = database.Repo(tar)
+    assert list(repo) == ["test1", "test2"]
+    assert tar.members == []
+
+
+def test_database_package_record():
+    """
+    Records keep the fields fastpac uses and parse the rest on demand
+    """
+    record = database.PackageRecord.from_desc(b"""
+    %FILENAME%
+    package-1.0.0
+
+    %NAME%
+    package
+
+    %CSIZE%
+    1234
+
+    %DEPENDS%
+    glibc
+    zlib
+    """)
+
+    assert record.name == "package"
+    assert record["filename"] == "package-1.0.0"
+    assert record["csize"] == 1234
+    assert "sha256sum" not in record
+    assert "depends" in record
+    assert record["depends"] == "glibc\nzlib"
+    assert record == database.PackageRecord.from_desc(record.desc())
+
+
+def test_database_record_fields_from_database(tmp_path):
+    """
+    Records from a repo tar keep no desc, other fields are read from the database again
+    """
+    raw_tar = create_tar([
+        {"name": "test1", "wow": "also"},
+        {"name": "test2", "wow": "too", "sha256sum": "ab" * 32}])
+    path = tmp_path / "core.db"
+    path.write_bytes(raw_tar)
+
+    for source in [database.Database(path=path), database.Database(data=raw_tar)]:
+        repo = database.Repo(tarfile.TarFile(fileobj=io.BytesIO(raw_tar)), source)
+        record = repo["test2"]
+        assert record.sha256sum == "ab" * 32
+        assert "wow" in record
+        assert record["wow"] == "too"
+        assert repo["test1"]["wow"] == "also"
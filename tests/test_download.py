@@ -1,4 +1,6 @@
 import pytest
+from hashlib import sha256
+import requests
 
 import fastpac.download as download
 from fastpac.search import PackageInfo
@@ -9,3 +11,147 @@ def test_download_assemble_package_url():
             PackageInfo(**{'mirror': '', 'name': '', 'size': 0, "repo": "core", "filename": "package.tar", "sha256": ""}), "https://a/", 'x86_64') == "https://a/core/os/x86_64/package.tar"
     assert download.assemble_package_url(
             PackageInfo(**{'mirror': '', 'name': '', 'size': 0, "repo": "extra", "filename": "package.tar.gz", "sha256": ""}), "https://b", 'armv7h') == "https://b/extra/os/armv7h/package.tar.gz"
+
+
+def test_download_hash_file(tmp_path):
+    path = tmp_path / "package.tar"
+    path.write_bytes(b"a" * 3000)
+    assert download.hash_file(path, chunk_size=1024) == sha256(b"a" * 3000).hexdigest()
+
+
+def test_download_file_to_path_verify(tmp_path, local_server):
+    body = b"package contents" * 1000
+    local_server.files["/package.tar"] = body
+    path = tmp_path / "package.tar"
+
+    download.download_file_to_path(local_server.url + "/package.tar", path, sha256=sha256(body).hexdigest())
+    assert path.read_bytes() == body
+
+    # Wrong hash, the download is thrown away and the earlier file is left alone
+    with pytest.raises(download.HashMismatchError):
+        download.download_file_to_path(local_server.url + "/package.tar", path, sha256="0" * 64)
+    assert path.read_bytes() == body
+    assert not download.part_path(path).exists()
+
+    # Missing file
+    with pytest.raises(requests.HTTPError):
+        download.download_file_to_path(local_server.url + "/missing.tar", path)
+
+
+def test_download_split_ranges():
+    assert download.split_ranges(10, 3) == [(0, 3), (4, 6), (7, 9)]
+    assert download.split_ranges(10, 1) == [(0, 9)]
+    assert download.split_ranges(2, 4) == [(0, 0), (1, 1)]
+
+
+def test_download_file_segmented(tmp_path, local_server):
+    body = bytes(range(256)) * 1000
+    local_server.files["/a/package.tar"] = body
+    local_server.files["/b/package.tar"] = body
+    path = tmp_path / "package.tar"
+
+    urls = [local_server.url + "/a/package.tar", local_server.url + "/b/package.tar", local_server.url + "/c/package.tar"]
+    # The third mirror does not have it, its range comes from the others
+    download.download_file_segmented(urls, path, len(body), sha256=sha256(body).hexdigest())
+    assert path.read_bytes() == body
+
+    ranges = {headers["Range"] for _, headers in local_server.requests}
+    assert {"bytes=0-85333", "bytes=85334-170666", "bytes=170667-255999"} <= ranges
+
+    # Mirrors that ignore ranges are not used
+    local_server.ignore_range.update(["/a/package.tar", "/b/package.tar"])
+    path.unlink()
+    with pytest.raises(IOError):
+        download.download_file_segmented(urls[:2], path, len(body))
+    assert not path.exists()
+    assert not download.part_path(path).exists()
+
+
+def test_download_file_to_path_resume(tmp_path, local_server):
+    body = bytes(range(256)) * 100
+    local_server.files["/package.tar"] = body
+    path = tmp_path / "package.tar"
+
+    # An earlier download stopped part way through
+    download.part_path(path).write_bytes(body[:1000])
+    download.download_file_to_path(local_server.url + "/package.tar", path, sha256=sha256(body).hexdigest())
+
+    assert local_server.requests[-1][1]["Range"] == "bytes=1000-"
+    assert path.read_bytes() == body
+    assert not download.part_path(path).exists()
+
+    # The mirror ignores the range, the download starts over
+    path.unlink()
+    download.part_path(path).write_bytes(b"garbage")
+    local_server.ignore_range.add("/package.tar")
+    download.download_file_to_path(local_server.url + "/package.tar", path, sha256=sha256(body).hexdigest())
+    assert path.read_bytes() == body
+
+
+def test_download_file_to_path_atomic(tmp_path, local_server):
+    local_server.files["/package.tar"] = b"corrupt"
+    path = tmp_path / "package.tar"
+
+    with pytest.raises(download.HashMismatchError):
+        download.download_file_to_path(local_server.url + "/package.tar", path, sha256="0" * 64)
+
+    # Nothing ever appears under the final name
+    assert not path.exists()
+    assert not download.part_path(path).exists()
+
+
+def test_download_file_to_path_buffer(tmp_path, local_server, monkeypatch):
+    # The body spans several buffers and ends part way through one
+    monkeypatch.setattr(download, "BUFFER_SIZE", 1000)
+    body = bytes(range(256)) * 100
+    local_server.files["/package.tar"] = body
+    path = tmp_path / "package.tar"
+
+    transfer = download.download_file_to_path(local_server.url + "/package.tar", path,
+                                              sha256=sha256(body).hexdigest(), preallocate=True)
+    assert path.read_bytes() == body
+    assert transfer.size == len(body)
+
+
+def test_copy_response_interrupted():
+    body = bytes(range(256)) * 20
+
+    class Raw:
+        # Sends 5000 of the bytes then the connection breaks
+        offset = 0
+
+        def readinto(self, buffer):
+            if self.offset >= 5000:
+                raise IOError("Connection reset")
+            count = min(len(buffer), 1000)
+            buffer[:count] = body[self.offset:self.offset + count]
+            self.offset += count
+            return count
+
+    class Response:
+        headers = {}
+        raw = Raw()
+
+    written = bytearray()
+    digest = sha256()
+    with pytest.raises(IOError):
+        download.copy_response(Response(), written.extend, digest)
+    # What arrived before the error is written and hashed
+    assert written == body[:5000]
+    assert digest.hexdigest() == sha256(body[:5000]).hexdigest()
+
+
+def test_download_file_to_path_preallocate_interrupted(tmp_path, local_server, monkeypatch):
+    body = b"a" * 5000
+    local_server.files["/package.tar"] = body
+    path = tmp_path / "package.tar"
+
+    def interrupted(response, write, digest=None, throttle=None):
+        write(memoryview(body[:1000]))
+        raise IOError("Connection reset")
+    monkeypatch.setattr(download, "copy_response", interrupted)
+
+    with pytest.raises(IOError):
+        download.download_file_to_path(local_server.url + "/package.tar", path, preallocate=True)
+    # Only what was written is kept to resume from
+    assert download.part_path(path).stat().st_size == 1000
@@ -0,0 +1,97 @@
+import pytest
+
+from fastpac.health import HealthyPicker, MirrorHealth
+from fastpac.picker import CapPicker, CounterPicker, SinglePicker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_health_circuit():
+    clock = FakeClock()
+    health = MirrorHealth(threshold=2, cooldown=10, max_cooldown=25, clock=clock)
+
+    health.failure("a")
+    assert health.available("a")
+    health.failure("a")
+    assert not health.available("a")
+    assert health.unavailable() == ["a"]
+
+    # Back after the cooldown, one more failure and it is out twice as long
+    clock.now = 10
+    assert health.available("a")
+    health.failure("a")
+    clock.now = 29
+    assert not health.available("a")
+    clock.now = 30
+    assert health.available("a")
+
+    # Capped at max_cooldown
+    health.failure("a")
+    clock.now = 54
+    assert not health.available("a")
+    clock.now = 55
+    assert health.available("a")
+
+    # A success resets everything
+    health.success("a")
+    health.failure("a")
+    assert health.available("a")
+
+
+def test_health_picker():
+    health = MirrorHealth(threshold=1)
+    health.failure("b")
+
+    picker = HealthyPicker(CounterPicker(["a", "b", "c"]), health)
+    assert [picker.next() for _ in range(4)] == ["a", "c", "a", "c"]
+
+    # Nothing else to pick from
+    picker = HealthyPicker(SinglePicker(["b"]), health, tries=3)
+    assert picker.next() == "b"
+
+
+def test_health_picker_cap():
+    health = MirrorHealth(threshold=1)
+    health.failure("a")
+    cappicker = CapPicker(["a", "b"], arg=1000)
+    picker = HealthyPicker(cappicker, health)
+
+    # First fit would always give a, its cap is left alone while it is out
+    assert [picker.next(size=10) for _ in range(3)] == ["b", "b", "b"]
+    assert cappicker.next(size=999) == "a"
+
+    # Too big for any cap, the first mirror that is not left out is used up
+    assert picker.next(size=2000) == "b"
+    assert cappicker.get_mirrors() == ["a"]
+
+    # Only a is left, it is used anyway
+    assert picker.next(size=0) == "a"
+
+
+def test_health_picker_single():
+    health = MirrorHealth(threshold=1)
+    health.failure("a")
+    assert HealthyPicker(SinglePicker(["a", "b"]), health).next() == "b"
+
+
+def test_health_picker_without_exclude():
+    health = MirrorHealth(threshold=1)
+    health.failure("a")
+
+    class OldPicker:
+        # A picker from before exclude, it is asked again
+        def __init__(self):
+            self.mirrors = ["a", "b"]
+
+        def next(self, size=0):
+            self.mirrors.append(self.mirrors.pop(0))
+            return self.mirrors[-1]
+
+    picker = HealthyPicker(OldPicker(), health)
+    assert [picker.next() for _ in range(2)] == ["b", "b"]
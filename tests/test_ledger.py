@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from fastpac.ledger import VerificationLedger
+
+
+def test_ledger_verified(tmp_path):
+    package = tmp_path / "package.tar"
+    package.write_bytes(b"contents")
+
+    ledger = VerificationLedger(tmp_path / "ledger.json")
+    assert not ledger.is_verified(package, "abc")
+
+    ledger.record(package, "abc")
+    assert ledger.is_verified(package, "abc")
+    # A new version of the package has a different hash
+    assert not ledger.is_verified(package, "def")
+
+    ledger.forget(package)
+    assert not ledger.is_verified(package, "abc")
+
+
+def test_ledger_file_changed(tmp_path):
+    package = tmp_path / "package.tar"
+    package.write_bytes(b"contents")
+
+    ledger = VerificationLedger(tmp_path / "ledger.json")
+    ledger.record(package, "abc")
+
+    # Same size, different mtime
+    package.write_bytes(b"CONTENTS")
+    os.utime(package, ns=(0, 0))
+    assert not ledger.is_verified(package, "abc")
+
+    package.unlink()
+    assert not ledger.is_verified(package, "abc")
+
+
+def test_ledger_save_load(tmp_path):
+    kept = tmp_path / "kept.tar"
+    kept.write_bytes(b"contents")
+    removed = tmp_path / "removed.tar"
+    removed.write_bytes(b"contents")
+
+    ledger = VerificationLedger(tmp_path / "ledger.json")
+    ledger.record(kept, "abc")
+    ledger.record(removed, "def")
+    removed.unlink()
+    ledger.save()
+
+    ledger = VerificationLedger(tmp_path / "ledger.json")
+    assert ledger.is_verified(kept, "abc")
+    assert str(removed) not in ledger._entries
@@ -0,0 +1,191 @@
+import argparse
+from hashlib import sha256
+from threading import Lock
+
+import pytest
+
+import fastpac.__main__ as fastpac_main
+from fastpac.database import Repo
+from fastpac.download import download_failures, download_retries
+from fastpac.health import MirrorHealth
+from fastpac.ledger import VerificationLedger
+from fastpac.packagelist import PackageLists
+from fastpac.picker import CapPicker, SinglePicker
+from fastpac.search import PackageInfo, RepoMeta
+from fastpac.store import ContentStore
+
+
+def serve_package(local_server, repo, name):
+    body = name.encode() * 1000
+    filename = f"{name}.tar"
+    local_server.files[f"/{repo}/os/x86_64/{filename}"] = body
+    return {"filename": filename, "csize": str(len(body)), "sha256sum": sha256(body).hexdigest()}
+
+
+class RecordingPicker:
+    """
+    Hands out mirrors in turn and remembers what it is told about them
+    """
+    def __init__(self, mirrors):
+        self.mirrors = mirrors
+        self.picks = 0
+        self.reports = []
+        self.failures = []
+
+    def next(self, size=0):
+        self.picks += 1
+        return self.mirrors[(self.picks - 1) % len(self.mirrors)]
+
+    def report(self, mirror, size, seconds, latency, transferred):
+        self.reports.append(mirror)
+
+    def report_failure(self, mirror, size):
+        self.failures.append(mirror)
+
+
+def make_info(name, body):
+    return PackageInfo(mirror="", repo="core", name=name, filename=f"{name}.tar", size=len(body),
+                       sha256=sha256(body).hexdigest())
+
+
+def test_download_package_failover(tmp_path, local_server):
+    body = b"contents" * 1000
+    bad, good = local_server.url + "/bad/", local_server.url + "/good/"
+    local_server.files["/good/core/os/x86_64/package.tar"] = body
+    picker = RecordingPicker([bad, good])
+    health = MirrorHealth(threshold=1)
+    failures = download_failures.value(mirror=bad)
+
+    transfers = fastpac_main.download_package(make_info("package", body), tmp_path, picker, Lock(), "x86_64",
+                                              health=health, backoff=0)
+    assert [transfer.url for transfer in transfers] == [good + "core/os/x86_64/package.tar"]
+    assert (tmp_path / "package.tar").read_bytes() == body
+
+    # The bad mirror is left out for a while and the picker learned about both
+    assert not health.available(bad)
+    assert health.available(good)
+    assert picker.failures == [bad]
+    assert picker.reports == [good]
+    assert download_failures.value(mirror=bad) == failures + 1
+
+
+def test_download_package_all_fail(tmp_path, local_server):
+    body = b"contents" * 1000
+    picker = RecordingPicker([local_server.url + "/a/", local_server.url + "/b/"])
+    retries = download_retries.value()
+
+    assert fastpac_main.download_package(make_info("package", body), tmp_path, picker, Lock(), "x86_64",
+                                         attempts=3, backoff=0) is None
+    assert picker.picks == 3
+    assert len(picker.failures) == 3
+    assert picker.reports == []
+    # Every attempt after the first is a retry
+    assert download_retries.value() == retries + 2
+    assert not (tmp_path / "package.tar").exists()
+
+
+def test_download_package_no_mirror(tmp_path, local_server):
+    body = b"contents" * 1000
+    local_server.files["/a/core/os/x86_64/package.tar"] = body
+
+    class OutOfMirrors(RecordingPicker):
+        # Like CapPicker when no mirror has room left, once
+        def next(self, size=0):
+            mirror = super().next(size)
+            return None if self.picks == 1 else mirror
+
+    picker = OutOfMirrors([local_server.url + "/a/"])
+    assert fastpac_main.download_package(make_info("package", body), tmp_path, picker, Lock(), "x86_64", backoff=0)
+    assert (tmp_path / "package.tar").read_bytes() == body
+    assert picker.failures == []
+
+    # Every mirror used up, CapPicker raises. That is a failed attempt instead of an error
+    picker = CapPicker([local_server.url + "/b/"], arg=0)
+    assert fastpac_main.download_package(make_info("other", body), tmp_path, picker, Lock(), "x86_64",
+                                         attempts=3, backoff=0) is None
+
+
+def test_download_package_corrupt_store(tmp_path, local_server):
+    body = b"contents" * 1000
+    local_server.files["/a/core/os/x86_64/package.tar"] = body
+    info = make_info("package", body)
+    store = ContentStore(tmp_path / "store")
+    ledger = VerificationLedger(tmp_path / "ledger.json")
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    picker = RecordingPicker([local_server.url + "/a/"])
+
+    fastpac_main.download_package(info, first, picker, Lock(), "x86_64", store=store, backoff=0)
+    # Taken from the store, the next run hashes it before trusting it
+    assert fastpac_main.download_package(info, second, picker, Lock(), "x86_64", ledger=ledger,
+                                         store=store) is None
+    assert not ledger.is_verified(second / "package.tar", info.sha256)
+
+    # Corrupting the hardlinked copy corrupts the store entry with it
+    with open(second / "package.tar", mode="r+b") as f:
+        f.write(b"BAD!")
+    assert not fastpac_main.check_package(info, second / "package.tar", ledger, store)
+    assert not store.path_for(info.sha256).exists()
+
+    # So it is downloaded again instead of put back from the store
+    assert fastpac_main.download_package(info, second, picker, Lock(), "x86_64", ledger=ledger,
+                                         store=store, backoff=0)
+    assert (second / "package.tar").read_bytes() == body
+    assert ledger.is_verified(second / "package.tar", info.sha256)
+
+
+class StopDaemon(Exception):
+    pass
+
+
+def test_run_daemon(tmp_path, local_server, monkeypatch):
+    lists = tmp_path / "lists"
+    lists.mkdir()
+    dest = tmp_path / "pkg"
+    dest.mkdir()
+    (lists / "host").write_text("a 1\n")
+
+    core = RepoMeta(name="core", mirror=local_server.url, db=Repo({"a": serve_package(local_server, "core", "a")}))
+    extra = RepoMeta(name="extra", mirror=local_server.url, db=Repo({"b": serve_package(local_server, "extra", "b")}))
+    config = {"package_list_dir": lists, "databases": [core, extra], "workers": 2, "backoff": 0,
+              "refresh_interval": 0}
+
+    class FakeWatcher:
+        def __init__(self, path, poll_interval):
+            self.calls = 0
+
+        def changes(self, timeout):
+            self.calls += 1
+            if self.calls == 1:
+                (lists / "new").write_text("b 1\n")
+                return [lists / "new"]
+            if self.calls == 2:
+                return []
+            raise StopDaemon()
+
+        def close(self):
+            pass
+
+    # The first refresh could not fetch core, the second could not load the config at all
+    reloads = iter([{"databases": [None, extra]}, ValueError("bad config")])
+
+    def load_config(path):
+        result = next(reloads)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(fastpac_main, "ListWatcher", FakeWatcher)
+    monkeypatch.setattr(fastpac_main, "load_config", load_config)
+
+    args = argparse.Namespace(config_file=tmp_path / "config.py", changed_only=False)
+    with pytest.raises(StopDaemon):
+        fastpac_main.run_daemon(args, config, PackageLists(lists), dest, SinglePicker([local_server.url]))
+
+    # The package added to a list was downloaded
+    assert (dest / "a.tar").is_file()
+    assert (dest / "b.tar").is_file()
+    # Both refreshes ran and the copy of core from before was kept
+    assert next(reloads, None) is None
+    assert config["databases"] == [core, extra]
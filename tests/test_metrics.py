@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from fastpac.metrics import Registry
+
+
+def test_counter():
+    registry = Registry()
+    transferred = registry.counter('fastpac_download_bytes_total', 'Bytes downloaded', ('mirror',))
+    transferred.inc(100, mirror="https://a")
+    transferred.inc(50, mirror="https://a")
+    transferred.inc(7, mirror="https://b")
+
+    assert transferred.value(mirror="https://a") == 150
+    # The same name gives the same metric
+    assert registry.counter('fastpac_download_bytes_total', 'Bytes downloaded', ('mirror',)) is transferred
+    with pytest.raises(ValueError):
+        registry.histogram('fastpac_download_bytes_total', 'Bytes downloaded')
+
+    assert registry.to_prometheus() == (
+        '# HELP fastpac_download_bytes_total Bytes downloaded\n'
+        '# TYPE fastpac_download_bytes_total counter\n'
+        'fastpac_download_bytes_total{mirror="https://a"} 150\n'
+        'fastpac_download_bytes_total{mirror="https://b"} 7\n'
+    )
+
+
+def test_histogram(tmp_path):
+    registry = Registry()
+    seconds = registry.histogram('fastpac_hash_seconds', 'Time to hash', buckets=(0.1, 1))
+    seconds.observe(0.05)
+    seconds.observe(0.5)
+    seconds.observe(1)
+    seconds.observe(5)
+
+    assert seconds.count() == 4
+    assert seconds.sum() == pytest.approx(6.55)
+    assert registry.to_prometheus().splitlines()[2:] == [
+        'fastpac_hash_seconds_bucket{le="0.1"} 1',
+        'fastpac_hash_seconds_bucket{le="1"} 3',
+        'fastpac_hash_seconds_bucket{le="+Inf"} 4',
+        'fastpac_hash_seconds_sum 6.55',
+        'fastpac_hash_seconds_count 4',
+    ]
+
+    registry.write_json(tmp_path / "metrics.json")
+    summary = json.loads((tmp_path / "metrics.json").read_text())
+    assert summary["fastpac_hash_seconds"]["values"][0]["count"] == 4
+
+
+def test_subscribe():
+    registry = Registry()
+    seen = []
+    registry.subscribe('fastpac_download_seconds', lambda value, labels: seen.append((value, labels)))
+
+    seconds = registry.histogram('fastpac_download_seconds', 'Time to download', ('mirror',))
+    with seconds.time(mirror="https://a"):
+        pass
+
+    assert len(seen) == 1
+    assert seen[0][1] == {"mirror": "https://a"}
+    assert seconds.count(mirror="https://a") == 1
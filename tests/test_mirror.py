@@ -84,3 +84,70 @@ def test_mirror_aslist():
     assert a(3) == list(range(3))
     assert a(5) == list(range(5))
     assert a(0) == []
+
+
+def test_probe_mirror(monkeypatch):
+    class Response:
+        headers = {"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}
+
+    def mockhead(url, timeout=None):
+        if url.startswith("https://down"):
+            raise requests.ConnectionError()
+        assert url == "https://a/sub/core/os/x86_64/core.db"
+        return Response()
+
+    monkeypatch.setattr(mirror, "head", mockhead)
+    result = mirror.probe_mirror("https://a/sub/")
+    assert result.mirror == "https://a/sub/"
+    assert result.last_modified == 1445412480
+    assert mirror.probe_mirror("https://down/") is None
+
+
+def test_probe_mirrors(monkeypatch, tmp_path):
+    results = {
+        "https://slow/": mirror.ProbeResult("https://slow/", 0.5, 1000),
+        "https://fast/": mirror.ProbeResult("https://fast/", 0.1, 1000),
+        "https://unknown/": mirror.ProbeResult("https://unknown/", 0.3, None),
+        "https://stale/": mirror.ProbeResult("https://stale/", 0.05, 1000 - 7200),
+        "https://down/": None,
+    }
+    probed = []
+
+    def mockprobe(url, **kwargs):
+        probed.append(url)
+        return results[url]
+
+    monkeypatch.setattr(mirror, "probe_mirror", mockprobe)
+    cache_file = tmp_path / "mirrors.json"
+
+    assert mirror.probe_mirrors(results, cache_file=cache_file) == ["https://fast/", "https://unknown/", "https://slow/"]
+    assert mirror.probe_mirrors(results, top=2) == ["https://fast/", "https://unknown/"]
+    assert len(probed) == 10
+
+    # The ranking is reused while it is fresh
+    assert mirror.probe_mirrors(results, top=1, cache_file=cache_file) == ["https://fast/"]
+    assert len(probed) == 10
+
+    # But not for other candidates or once it is too old
+    mirror.probe_mirrors(["https://fast/"], cache_file=cache_file)
+    assert len(probed) == 11
+    mirror.probe_mirrors(results, cache_file=cache_file, ttl=-1)
+    assert len(probed) == 16
+
+
+def test_probe_mirrors_all_down(monkeypatch, tmp_path):
+    mirrors = ["https://a/", "https://b/"]
+    up = False
+
+    def mockprobe(url, **kwargs):
+        return mirror.ProbeResult(url, 0.1 if url == "https://b/" else 0.2, None) if up else None
+
+    monkeypatch.setattr(mirror, "probe_mirror", mockprobe)
+    cache_file = tmp_path / "mirrors.json"
+
+    # Nothing answered, every mirror is kept and nothing is remembered
+    assert mirror.probe_mirrors(mirrors, cache_file=cache_file) == mirrors
+    assert not cache_file.exists()
+
+    up = True
+    assert mirror.probe_mirrors(mirrors, cache_file=cache_file) == ["https://b/", "https://a/"]
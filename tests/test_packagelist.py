@@ -0,0 +1,29 @@
+import os
+
+from fastpac.packagelist import PackageLists, read_package_list
+
+
+def test_read_package_list(tmp_path):
+    path = tmp_path / "host"
+    path.write_text("linux 5.4.2.arch1-1\nbash 5.0.011-1\n\nvim\n")
+    assert read_package_list(path) == {"linux", "bash", "vim"}
+
+
+def test_package_lists(tmp_path):
+    (tmp_path / "a").write_text("linux 1\nbash 1\n")
+    (tmp_path / "b").write_text("bash 1\nvim 1\n")
+    lists = PackageLists(tmp_path, workers=2)
+
+    names = list(lists.iter_names())
+    assert sorted(names) == ["bash", "linux", "vim"]
+
+    # Unchanged lists are not read again
+    stat = (tmp_path / "a").stat()
+    lists._files[tmp_path / "a"] = (stat.st_mtime_ns, stat.st_size, frozenset({"cached"}))
+    assert sorted(lists.iter_names()) == ["bash", "cached", "vim"]
+
+    # Changed and removed lists are
+    (tmp_path / "a").write_text("zsh 1\n")
+    os.utime(tmp_path / "a", ns=(0, 0))
+    os.remove(tmp_path / "b")
+    assert sorted(lists.iter_names()) == ["zsh"]
@@ -1,5 +1,7 @@
 import pytest
 
+import random
+
 import fastpac.picker as picker
 
 def test_picker_random(monkeypatch):
@@ -57,6 +59,30 @@ def test_picker_datacap():
     assert mirrorpicker.next(size=2*mb) == "a"
     assert mirrorpicker.get_mirrors() == ["a", "b", "c"]
 
+def test_picker_exclude():
+    assert picker.SinglePicker(["a", "b"]).next(exclude={"a"}) == "b"
+    assert picker.SinglePicker(["a", "b"]).next(exclude={"a", "b"}) == "a"
+    assert {picker.RandomPicker(["a", "b"]).next(exclude={"a"}) for _ in range(20)} == {"b"}
+
+    mirrorpicker = picker.CounterPicker(["a", "b", "c"], arg=2)
+    assert [mirrorpicker.next(exclude={"b"}) for _ in range(4)] == ["a", "a", "c", "c"]
+
+    mirrorpicker = picker.LeastUsedPicker(["a", "b", "c"])
+    assert mirrorpicker.next(size=5, exclude={"a"}) == "b"
+    assert mirrorpicker.next(size=5, exclude={"a"}) == "c"
+    assert mirrorpicker.next(size=1) == "a"
+
+    mirrorpicker = picker.ThroughputPicker(["a", "b"], arg=0)
+    assert mirrorpicker.next(size=5, exclude={"a"}) == "b"
+
+    mirrorpicker = picker.CapPicker(["a", "b", "c"], arg=100)
+    assert mirrorpicker.next(size=60, exclude={"a"}) == "b"
+    # Nothing else has room, an excluded mirror is better than none
+    assert mirrorpicker.next(size=60, exclude={"a", "c"}) == "a"
+    assert mirrorpicker.next(size=60, exclude={"c"}) == "c"
+    assert mirrorpicker.next(size=60) is None
+
+
 def test_picker_counter():
 
     mirrorpicker = picker.CounterPicker(["a", "b", "c"], arg=1)
@@ -90,3 +116,66 @@ def test_picker_leastused():
     assert mirrorpicker.next(size=2) == "c"
     assert mirrorpicker.next(size=3) == "b"
     assert mirrorpicker.next(size=1) == "c"
+
+def test_picker_throughput(monkeypatch):
+    # No exploring
+    monkeypatch.setattr(picker, "random", lambda: 1)
+    mb = 10**6
+
+    mirrorpicker = picker.ThroughputPicker(["a", "b"])
+    # Nothing is known, spread by queued bytes
+    assert mirrorpicker.next(size=mb) == "a"
+    assert mirrorpicker.next(size=mb) == "b"
+
+    # a does 10 MB/s and b 1 MB/s
+    mirrorpicker.report("a", mb, seconds=0.2, latency=0.1)
+    mirrorpicker.report("b", mb, seconds=1.1, latency=0.1)
+    assert mirrorpicker.expected_completion("a", mb) == pytest.approx(0.2)
+    assert mirrorpicker.expected_completion("b", mb) == pytest.approx(1.1)
+
+    # a gets work until its queue is as long as b's
+    assert [mirrorpicker.next(size=mb) for _ in range(10)] == ["a"] * 10
+    assert mirrorpicker.next(size=mb) == "b"
+
+    # Failed work is taken off the queue
+    mirrorpicker.report_failure("b", mb)
+    assert mirrorpicker.expected_completion("b", mb) == pytest.approx(1.1)
+
+    # Exploring picks a random mirror
+    monkeypatch.setattr(picker, "random", lambda: 0)
+    monkeypatch.setattr(picker, "randrange", lambda start, stop: 1)
+    assert mirrorpicker.next(size=mb) == "b"
+
+def test_picker_heap_same_as_linear():
+    """
+    The heap based pickers pick exactly what a linear scan would
+    """
+    rng = random.Random(0)
+    mirrors = [f"m{num}" for num in range(37)]
+
+    leastused = picker.LeastUsedPicker(mirrors)
+    used = [[mirror, 0] for mirror in mirrors]
+    for _ in range(2000):
+        size = rng.randrange(0, 100)
+        smallest = min(range(len(used)), key=lambda num: used[num][1])
+        used[smallest][1] += size
+        assert leastused.next(size=size) == used[smallest][0]
+
+    cap = 1000
+    cappicker = picker.CapPicker(mirrors, arg=cap)
+    quotas = [[mirror, 0] for mirror in mirrors]
+    for _ in range(2000):
+        size = rng.choice([rng.randrange(0, 200), cap + 1]) if rng.random() < 0.01 else rng.randrange(0, 200)
+        if size > cap:
+            if not quotas:
+                break
+            expected = quotas.pop(0)[0]
+        else:
+            expected = None
+            for num, (mirror, quota) in enumerate(quotas):
+                if quota + size < cap:
+                    quotas[num][1] += size
+                    expected = mirror
+                    break
+        assert cappicker.next(size=size) == expected
+        assert cappicker.get_mirrors() == [mirror for mirror, _ in quotas]
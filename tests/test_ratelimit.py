@@ -0,0 +1,51 @@
+import pytest
+
+from fastpac.ratelimit import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(100, clock=clock)
+
+    # A full burst to start with, then the rate
+    assert bucket.reserve(100) == 0
+    assert bucket.reserve(50) == pytest.approx(0.5)
+    assert bucket.reserve(50) == pytest.approx(1.0)
+
+    clock.now = 1.0
+    assert bucket.reserve(100) == pytest.approx(1.0)
+
+    # Unused time does not build up past the burst
+    clock.now = 100.0
+    assert bucket.reserve(100) == 0
+    assert bucket.reserve(100) == pytest.approx(1.0)
+
+    # Changed or removed at runtime
+    bucket.set_rate(200)
+    assert bucket.reserve(100) == pytest.approx(1.0)
+    bucket.set_rate(None)
+    assert bucket.reserve(10**9) == 0
+
+
+def test_rate_limiter():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=1000, mirror_rate=100, clock=clock)
+    assert limiter.limited()
+
+    # Each mirror has its own limit, the total is shared
+    assert limiter.reserve("https://a", 100) == 0
+    assert limiter.reserve("https://a", 100) == pytest.approx(1.0)
+    assert limiter.reserve("https://b", 100) == 0
+
+    limiter.set_rates(None, None)
+    assert not limiter.limited()
+    assert limiter.throttle("https://a") is None
+    assert limiter.reserve("https://a", 10**9) == 0
@@ -0,0 +1,59 @@
+import pytest
+
+from fastpac.database import PackageRecord, Repo, relation_names
+from fastpac.resolve import Resolver
+from fastpac.search import PackageIndex, RepoMeta
+
+
+def make_index():
+    core = Repo({
+        "bash": {"filename": "bash.tar", "csize": "1", "provides": "sh", "depends": "readline>=7.0\nglibc"},
+        "readline": {"filename": "readline.tar", "csize": "1", "depends": "glibc\nncurses"},
+        "glibc": {"filename": "glibc.tar", "csize": "1"},
+    })
+    extra = Repo({
+        "ncurses": {"filename": "ncurses.tar", "csize": "1"},
+        "dash": {"filename": "dash.tar", "csize": "1", "provides": "sh"},
+        "python-new": {"filename": "python-new.tar", "csize": "1", "replaces": "python-old"},
+    })
+    return PackageIndex([
+        RepoMeta(name="core", mirror="https://a", db=core),
+        RepoMeta(name="extra", mirror="https://a", db=extra),
+    ])
+
+
+def test_relation_names():
+    assert relation_names("") == ()
+    assert relation_names("glibc>=2.3\nsh\nlibfoo.so=1-64\nzlib<2") == ("glibc", "sh", "libfoo.so", "zlib")
+
+
+def test_record_relations():
+    record = PackageRecord.from_desc(b"%NAME%\nbash\n%DEPENDS%\nreadline>=7.0\nglibc\n%PROVIDES%\nsh=5.0\n")
+    assert record.depend_names == ("readline", "glibc")
+    assert record.provide_names == ("sh",)
+    assert record.replace_names == ()
+
+
+def test_resolver_resolve():
+    resolver = Resolver(make_index())
+
+    assert resolver.resolve("bash") == "bash"
+    # Earliest repo wins between providers
+    assert resolver.resolve("sh") == "bash"
+    assert resolver.resolve("python-old") == "python-new"
+    assert resolver.resolve("does-not-exist") is None
+
+
+def test_resolver_closure():
+    resolver = Resolver(make_index())
+
+    assert resolver.closure(["sh", "python-old", "nope"]) == (
+        {"bash", "readline", "glibc", "ncurses", "python-new"}, {"nope"})
+    assert resolver.closure(["sh", "nope"], depends=False) == ({"bash"}, {"nope"})
+
+
+def test_closure_generator():
+    # Names can be streamed in
+    found, missing = Resolver(make_index()).closure(name for name in ["bash", "zsh"])
+    assert found == {"bash", "readline", "glibc", "ncurses"}
+    assert missing == {"zsh"}
@@ -0,0 +1,35 @@
+import pytest
+
+from fastpac.download import Transfer
+from fastpac.schedule import order_packages, predict_makespan, report_makespan
+from fastpac.search import PackageInfo
+
+
+def make_info(name, size):
+    return PackageInfo(mirror="", repo="core", name=name, filename=f"{name}.tar", size=size, sha256="")
+
+
+def test_schedule_order():
+    infos = [make_info("b", 1), make_info("a", 5), make_info("c", 5)]
+
+    assert [info.name for info in order_packages(infos)] == ["a", "c", "b"]
+    assert [info.name for info in order_packages(infos, "name")] == ["a", "b", "c"]
+    with pytest.raises(ValueError):
+        order_packages(infos, "random")
+
+
+def test_schedule_predict_makespan():
+    # Alphabetical order leaves the big package for last
+    assert predict_makespan([1, 1, 1, 1, 4], workers=2, bandwidth=1) == 6
+    assert predict_makespan([4, 1, 1, 1, 1], workers=2, bandwidth=1) == 4
+    assert predict_makespan([4, 2], workers=4, bandwidth=2) == 2
+
+
+def test_schedule_report_makespan(caplog):
+    caplog.set_level("INFO")
+    results = [[Transfer("a", 4 * 10**6, 0, 4)], [Transfer("b", 10**6, 0, 0.5), Transfer("c", 10**6, 0, 0.5)]]
+    report_makespan(results, workers=2, elapsed=4.5)
+    assert "Downloaded 2 packages (6.0 MB) in 4.5s, predicted 3.3s, ideal 2.5s" in caplog.text
+
+    report_makespan([], workers=2, elapsed=1)
+    assert "Nothing was downloaded" in caplog.text
@@ -15,7 +15,7 @@ def test_search_fetch_repo(monkeypatch):
     output_var = b""
     def mockdownload(url):
         assert url == input_var
-        return output_var
+        return output_var, None
 
     monkeypatch.setattr(search, "download_tar", mockdownload)
 
@@ -36,10 +36,10 @@ def test_search_find_package():
         ]
 
     assert search.find_package("package", data) == PackageInfo(**{
-            "mirror": "https://a", "repo": "core", "filename": "package.tar", "name": "package", "size": "2", "sha256" :""})
+            "mirror": "https://a", "repo": "core", "filename": "package.tar", "name": "package", "size": 2, "sha256" :""})
 
     assert search.find_package("package2", data) == PackageInfo(**{
-            "mirror": "https://b", "repo": "core2", "filename": "package2.tar", "name": "package2", "size": "1", "sha256" :""})
+            "mirror": "https://b", "repo": "core2", "filename": "package2.tar", "name": "package2", "size": 1, "sha256" :""})
 
     assert search.find_package("package_does_not_exist", data) == None
 
@@ -54,3 +54,54 @@ def test_search_gen_dbs():
     # Uncompressed
     assert next(gen) == "https://a.com/core.db"
     assert next(gen) == "https://a.com/core.files"
+
+
+def test_search_download_repos_order(monkeypatch):
+    def mockdownload(url):
+        return {"package": {"filename": url}}, None
+
+    monkeypatch.setattr(search, "download_tar", mockdownload)
+
+    # Mirrors can be a generator, every repo still sees all of them
+    repos = search.download_repos(["core", "extra", "community"], (m for m in ["https://a"]), workers=2)
+    assert [repo.name for repo in repos] == ["core", "extra", "community"]
+    assert repos[1].db["package"]["filename"] == "https://a/extra/os/x86_64/extra.db.tar.gz"
+
+
+def test_search_download_repos_race(monkeypatch):
+    def mockdownload(url):
+        # Only the second mirror has the repo
+        if url.startswith("https://b/"):
+            return {"package": {"filename": "package.tar"}}, None
+
+    monkeypatch.setattr(search, "download_tar", mockdownload)
+
+    repos = search.download_repos(["core"], ["https://a", "https://b", "https://c"], race=2)
+    assert repos[0].mirror == "https://b"
+
+    # None of the racers have it, the rest are tried in order
+    repos = search.download_repos(["core"], ["https://a", "https://c", "https://b"], race=2)
+    assert repos[0].mirror == "https://b"
+
+
+def test_search_package_index():
+    data = [
+            RepoMeta(**{"name": "core", "mirror": "https://a", "db": Repo({"package": {"filename": "package.tar", "csize": "2"}})}),
+            None,
+            RepoMeta(**{"name": "extra", "mirror": "https://b", "db": Repo({
+                "package": {"filename": "package-old.tar", "csize": "3"},
+                "package2": {"filename": "package2.tar", "csize": "1", "sha256sum": "abc"}})})
+        ]
+    index = search.PackageIndex(data)
+
+    assert len(index) == 2
+    assert "package2" in index
+
+    # Earlier repos win, the same as find_package
+    for name in ["package", "package2", "package_does_not_exist"]:
+        assert index.find(name) == search.find_package(name, [repo for repo in data if repo])
+
+    assert index.find_all(["package2", "package_does_not_exist"]) == {
+        "package2": PackageInfo(mirror="https://b", repo="extra", name="package2", filename="package2.tar", size=1, sha256="abc"),
+        "package_does_not_exist": None
+    }
@@ -0,0 +1,37 @@
+import threading
+
+import pytest
+
+from fastpac import session
+
+
+def test_session_shared():
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(session.get_session())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(s is sessions[0] for s in sessions)
+
+
+def test_session_configure():
+    before = session.get_session()
+    session.configure(pool_size=3)
+    after = session.get_session()
+
+    assert after is not before
+    assert after.get_adapter("https://a").poolmanager.connection_pool_kw["maxsize"] == 3
+    session.configure(pool_size=10)
+
+
+def test_session_keep_alive(local_server):
+    local_server.files["/a"] = b"a"
+    local_server.files["/b"] = b"b"
+
+    assert session.get(local_server.url + "/a").content == b"a"
+    assert session.get(local_server.url + "/b").content == b"b"
+
+    # Both requests came over the same connection
+    assert local_server.clients[0] == local_server.clients[1]
@@ -0,0 +1,38 @@
+import pytest
+
+from fastpac.database import Repo
+from fastpac.search import RepoMeta
+from fastpac.snapshot import RepoSnapshot
+
+
+def make_repos(core, extra):
+    return [
+        RepoMeta(name="core", mirror="https://a", db=Repo({name: {"filename": filename} for name, filename in core.items()})),
+        RepoMeta(name="extra", mirror="https://a", db=Repo({name: {"filename": filename} for name, filename in extra.items()})),
+    ]
+
+
+def test_snapshot_changed(tmp_path):
+    snapshot = RepoSnapshot(tmp_path / "snapshot.json")
+    repos = make_repos({"a": "a-1", "b": "b-1"}, {"c": "c-1", "d": "d-1"})
+
+    # First run, everything is new
+    assert snapshot.changed(repos, ["a", "c"]) == {"a", "c"}
+    snapshot.update(repos, ["a", "c"])
+    snapshot.save()
+
+    snapshot = RepoSnapshot(tmp_path / "snapshot.json")
+    assert snapshot.changed(repos, ["a", "c"]) == set()
+
+    # c was upgraded, b is not wanted, d is newly wanted
+    repos = make_repos({"a": "a-1", "b": "b-2"}, {"c": "c-2", "d": "d-1"})
+    assert snapshot.changed(repos, ["a", "c", "d"]) == {"c", "d"}
+
+
+def test_snapshot_failed(tmp_path):
+    snapshot = RepoSnapshot(tmp_path / "snapshot.json")
+    repos = make_repos({"a": "a-1", "b": "b-1"}, {})
+
+    # b could not be downloaded, the next run tries it again
+    snapshot.update(repos, ["a", "b"], failed=["b"])
+    assert snapshot.changed(repos, ["a", "b"]) == {"b"}
@@ -0,0 +1,43 @@
+import os
+from hashlib import sha256
+
+import pytest
+
+from fastpac import store as store_module
+from fastpac.store import ContentStore, place
+
+
+def test_store(tmp_path):
+    store = ContentStore(tmp_path / "store")
+    package = tmp_path / "a" / "foo.pkg"
+    package.parent.mkdir()
+    package.write_bytes(b"foo")
+    digest = sha256(b"foo").hexdigest()
+
+    assert not store.fetch(digest, tmp_path / "foo.pkg")
+
+    store.add(digest, package)
+    assert store.path_for(digest).read_bytes() == b"foo"
+
+    dest = tmp_path / "b" / "foo.pkg"
+    dest.parent.mkdir()
+    assert store.fetch(digest, dest)
+    assert dest.read_bytes() == b"foo"
+    # Same filesystem, so a hardlink
+    assert os.path.samefile(dest, package)
+    assert store.take_stats() == (1, 3)
+    assert store.take_stats() == (0, 0)
+
+
+def test_place_copy(tmp_path, monkeypatch):
+    def no_link(source, dest):
+        raise OSError("Invalid cross-device link")
+    monkeypatch.setattr(store_module.os, "link", no_link)
+    monkeypatch.setattr(store_module, "reflink", no_link)
+
+    (tmp_path / "source").write_bytes(b"foo")
+    (tmp_path / "dest").write_bytes(b"old")
+    place(tmp_path / "source", tmp_path / "dest")
+    assert (tmp_path / "dest").read_bytes() == b"foo"
+    assert not os.path.samefile(tmp_path / "source", tmp_path / "dest")
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["dest", "source"]
@@ -0,0 +1,18 @@
+import pytest
+
+from fastpac.util import atomic_write
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "state.json"
+    with atomic_write(path) as f:
+        f.write("new")
+    assert path.read_text() == "new"
+
+    # A failed write leaves the old file and nothing else
+    with pytest.raises(ValueError):
+        with atomic_write(path) as f:
+            f.write("half")
+            raise ValueError()
+    assert path.read_text() == "new"
+    assert list(tmp_path.iterdir()) == [path]
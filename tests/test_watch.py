@@ -0,0 +1,22 @@
+import pytest
+
+from fastpac import watch
+from fastpac.watch import ListWatcher
+
+
+@pytest.mark.parametrize("use_inotify", [False, True])
+def test_list_watcher(tmp_path, use_inotify):
+    if use_inotify and not watch.have_inotify:
+        pytest.skip("inotify_simple is not installed")
+
+    (tmp_path / "old").write_text("a 1\n")
+    watcher = ListWatcher(tmp_path, poll_interval=0.01, use_inotify=use_inotify)
+    try:
+        # Files that were there from the start are not changes
+        assert watcher.changes(timeout=0.05) == []
+
+        (tmp_path / "new").write_text("b 1\n")
+        assert watcher.changes(timeout=1) == [tmp_path / "new"]
+        assert watcher.changes(timeout=0.05) == []
+    finally:
+        watcher.close()